@@ -0,0 +1,307 @@
+"""Agreement between a metric's judge and human labels, for calibrating metric prompts.
+
+Takes the output of evaluation.py and the dataset it scored, where each record carries a
+human score (by default in its "score" field, or "<metric>_score" when present). Judge and
+human scores are parsed per the metric's scoring rubric into small integer category codes:
+Likert and binary scores map to their scale points, float scores are quantized to
+FLOAT_LEVELS steps. Every statistic is then computed from the human x judge confusion
+matrix, so hundreds of thousands of rows reduce to a few hundred counts:
+
+- exact match, Cohen's kappa and quadratically weighted kappa
+- Spearman's rank correlation (with tied ranks averaged) and mean absolute error
+- bootstrap confidence intervals, by drawing resampled confusion matrices from a multinomial
+  (equivalent to resampling rows with replacement) and computing all statistics at once
+
+Reports are cached per metric version and data, so re-running after a prompt change only
+recomputes the metrics whose version or judgements changed.
+
+    $ python agreement.py results.jsonl dataset.jsonl --metrics .data/metrics.sqlite3
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from evaluation import close_metrics, iter_records, load_metrics, parse_scoring_rubric
+from metric_bundle import metric_hash
+from prompt_engineer import reserved_metric_info
+
+
+DEFAULT_CACHE_PATH = os.environ.get("AGREEMENT_CACHE_PATH", os.path.join(".cache", "agreement.sqlite3"))
+DEFAULT_LABEL_FIELD = "score"
+DEFAULT_BOOTSTRAP = 1000
+DEFAULT_CONFIDENCE = 0.95
+# Float rubrics are compared on this many evenly spaced levels (0.05 steps on 0 - 1)
+FLOAT_LEVELS = 21
+STATISTICS = ("exact_match", "kappa", "weighted_kappa", "spearman", "mae")
+
+
+def scale(scoring_rubric):
+    """(category values, code function) for a rubric; codes are 0..k-1, or -1 for unusable scores."""
+    kind, low, high = parse_scoring_rubric(scoring_rubric)
+    if kind == "float":
+        values = np.linspace(low, high, FLOAT_LEVELS)
+        steps = FLOAT_LEVELS - 1
+    else:
+        values = np.arange(low, high + 1, dtype=np.float64)
+        steps = high - low
+
+    def codes(scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            position = (scores - low) / (high - low) * steps
+            usable = np.isfinite(position) & (position >= -1e-9) & (position <= steps + 1e-9)
+            if kind != "float":
+                usable &= np.isclose(position, np.round(position))
+        return np.where(usable, np.round(np.where(usable, position, 0)), -1).astype(np.int16)
+
+    return values, codes
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def confusion_matrix(human, judge, k):
+    """k x k counts of (human, judge) code pairs; rows are human categories."""
+    return np.bincount(human.astype(np.int64) * k + judge, minlength=k * k).reshape(k, k)
+
+
+def table_statistics(tables, values):
+    """All agreement statistics of one (k, k) or many (b, k, k) confusion matrices, vectorized."""
+    tables = np.asarray(tables, dtype=np.float64)
+    single = tables.ndim == 2
+    if single:
+        tables = tables[None]
+    k = len(values)
+    n = tables.sum(axis=(1, 2))
+    rows = tables.sum(axis=2)
+    cols = tables.sum(axis=1)
+    expected = rows[:, :, None] * cols[:, None, :] / n[:, None, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = np.trace(tables, axis1=1, axis2=2) / n
+        chance = np.trace(expected, axis1=1, axis2=2) / n
+        kappa = (observed - chance) / (1 - chance)
+
+        positions = np.arange(k)
+        weights = (positions[:, None] - positions[None, :]) ** 2 / max(1, k - 1) ** 2
+        weighted_kappa = 1 - (tables * weights).sum(axis=(1, 2)) / (expected * weights).sum(axis=(1, 2))
+
+        mae = (tables * np.abs(values[:, None] - values[None, :])).sum(axis=(1, 2)) / n
+
+        # Average rank of each category: rows/cols before it, plus the middle of its own tie block
+        row_ranks = np.cumsum(rows, axis=1) - rows + (rows + 1) / 2
+        col_ranks = np.cumsum(cols, axis=1) - cols + (cols + 1) / 2
+        mean_rank = (n + 1) / 2
+        row_dev = row_ranks - mean_rank[:, None]
+        col_dev = col_ranks - mean_rank[:, None]
+        covariance = (tables * row_dev[:, :, None] * col_dev[:, None, :]).sum(axis=(1, 2))
+        spearman = covariance / np.sqrt((rows * row_dev ** 2).sum(axis=1) * (cols * col_dev ** 2).sum(axis=1))
+
+    statistics = {"exact_match": observed, "kappa": kappa, "weighted_kappa": weighted_kappa, "spearman": spearman, "mae": mae}
+    if single:
+        return {name: float(value[0]) for name, value in statistics.items()}
+    return statistics
+
+
+def bootstrap_intervals(table, values, samples=DEFAULT_BOOTSTRAP, confidence=DEFAULT_CONFIDENCE, seed=0):
+    # Resampling n rows with replacement is a multinomial draw over the table's cells
+    table = np.asarray(table)
+    n = int(table.sum())
+    if not n or not samples:
+        return {}
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(n, table.ravel() / n, size=samples).reshape(samples, *table.shape)
+    statistics = table_statistics(draws, values)
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for name, estimates in statistics.items():
+        estimates = estimates[np.isfinite(estimates)]
+        if len(estimates):
+            low, high = np.percentile(estimates, [tail, 100 - tail])
+            intervals[name] = [float(low), float(high)]
+    return intervals
+
+
+def _json_number(value):
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+
+def agreement_report(metric, human_scores, judge_scores, samples=DEFAULT_BOOTSTRAP, confidence=DEFAULT_CONFIDENCE, seed=0):
+    """Agreement of aligned human and judge scores (arrays, NaN for missing) on the metric's rubric."""
+    values, codes = scale(metric["scoring_rubric"])
+    human, judge = codes(human_scores), codes(judge_scores)
+    usable = (human >= 0) & (judge >= 0)
+    table = confusion_matrix(human[usable], judge[usable], len(values))
+    report = {"metric": metric["name"], "version": metric.get("version"), "scoring_rubric": metric["scoring_rubric"],
+              "rows": int(len(human)), "compared": int(usable.sum()), "skipped": int((~usable).sum())}
+    if report["compared"]:
+        report.update({name: _json_number(value) for name, value in table_statistics(table, values).items()})
+        report["intervals"] = bootstrap_intervals(table, values, samples, confidence, seed)
+        report["confidence"] = confidence
+    report["categories"] = [float(value) if metric["scoring_rubric"].lower().startswith("float") else int(value) for value in values]
+    report["confusion"] = table.tolist()
+    return report
+
+
+class AgreementCache:
+    """Reports keyed on the metric's definition and the exact scores compared."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS reports (
+                    key TEXT PRIMARY KEY,
+                    metric TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT report FROM reports WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, metric, version, report):
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO reports (key, metric, version, report, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (key, metric, version, json.dumps(report), time.time()))
+
+
+def metric_version(metric):
+    # The store's version number when there is one, and always the definition's content hash
+    return f"{metric.get('version') or 0}:{metric_hash(metric)[:16]}"
+
+
+def report_key(metric, human_scores, judge_scores, samples, confidence, seed):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([metric["name"], metric_version(metric), samples, confidence, seed]).encode("utf-8"))
+    digest.update(np.ascontiguousarray(human_scores, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(judge_scores, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def cached_agreement_report(metric, human_scores, judge_scores, cache=None, samples=DEFAULT_BOOTSTRAP,
+                            confidence=DEFAULT_CONFIDENCE, seed=0):
+    key = report_key(metric, human_scores, judge_scores, samples, confidence, seed)
+    if cache is not None:
+        report = cache.get(key)
+        if report is not None:
+            return report
+    report = agreement_report(metric, human_scores, judge_scores, samples, confidence, seed)
+    if cache is not None:
+        cache.set(key, metric["name"], metric_version(metric), report)
+    return report
+
+
+def load_scores(results_path, dataset_path, label_field=DEFAULT_LABEL_FIELD):
+    """{metric name: (human scores, judge scores)} as aligned float arrays, joined on the record index."""
+    rows = [{field: value for field, value in record.items() if field == label_field or field.endswith("_" + label_field)}
+            for record in iter_records(dataset_path)]
+    fields = set().union(*rows) if rows else set()
+    labels = {field: np.fromiter((_to_float(row.get(field)) for row in rows), np.float64, len(rows)) for field in fields}
+    default_labels = labels.get(label_field)
+
+    indexes, judged = {}, {}
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            result = json.loads(line)
+            indexes.setdefault(result["metric"], []).append(result["index"])
+            judged.setdefault(result["metric"], []).append(_to_float(result.get("score")))
+
+    scores = {}
+    for name, positions in indexes.items():
+        # A per-metric label column ("groundedness_score") wins over the shared one
+        column = labels.get(f"{name}_{label_field}", default_labels)
+        if column is None:
+            continue
+        positions = np.asarray(positions, dtype=np.int64)
+        human = np.full(len(positions), math.nan)
+        inside = positions < len(column)
+        human[inside] = column[positions[inside]]
+        scores[name] = (human, np.asarray(judged[name], dtype=np.float64))
+    return scores
+
+
+def resolve_rubric_metric(name, metrics=None):
+    # Only the rubric is needed, so base metrics don't need a generated prompt
+    if metrics and name in metrics:
+        return metrics[name]
+    if name in reserved_metric_info:
+        return {"name": name, **reserved_metric_info[name], "prompt": ""}
+    raise KeyError(f"Unknown metric: {name!r}")
+
+
+def format_report(report):
+    lines = [f"{report['metric']} ({report['scoring_rubric']}): {report['compared']} compared, {report['skipped']} skipped"]
+    for name in STATISTICS:
+        if report.get(name) is None:
+            continue
+        interval = report.get("intervals", {}).get(name)
+        bounds = f"  [{interval[0]:.3f}, {interval[1]:.3f}]" if interval else ""
+        lines.append(f"  {name:<15}{report[name]:.3f}{bounds}")
+    width = max(len(str(value)) for value in report["categories"] + [count for row in report["confusion"] for count in row])
+    lines.append("  confusion (rows: human, columns: judge)")
+    lines.append("  " + " " * (width + 1) + " ".join(f"{category:>{width}}" for category in report["categories"]))
+    for category, row in zip(report["categories"], report["confusion"]):
+        if any(row):
+            lines.append(f"  {category:>{width}} " + " ".join(f"{count:>{width}}" for count in row))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how well metric judges agree with human labels.")
+    parser.add_argument("results", help="evaluation.py output JSONL")
+    parser.add_argument("dataset", help="the records that were scored (JSONL or CSV), with human scores")
+    parser.add_argument("--metrics", help="deployed metrics (JSONL, metric store or bundle), for their rubric and version")
+    parser.add_argument("--label-field", default=DEFAULT_LABEL_FIELD, help="human score field; <metric>_<field> is used when present")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP, help="bootstrap samples for the intervals (0 to skip)")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the reports as JSONL")
+    parser.add_argument("--no-cache", action="store_true", help="recompute even if a report is cached")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    deployed = load_metrics(args.metrics) if args.metrics else None
+    try:
+        scores = load_scores(args.results, args.dataset, args.label_field)
+        loaded = time.perf_counter()
+        cache = None if args.no_cache else AgreementCache()
+        for name, (human, judge) in sorted(scores.items()):
+            report = cached_agreement_report(resolve_rubric_metric(name, deployed), human, judge, cache,
+                                             args.bootstrap, args.confidence, args.seed)
+            print(json.dumps(report) if args.json else format_report(report))
+    finally:
+        # A bundle's metrics are decoded on lookup, so it stays open until the reports are done
+        close_metrics(deployed)
+    print(f"loaded in {loaded - started:.2f}s, analysed in {time.perf_counter() - loaded:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
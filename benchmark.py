@@ -0,0 +1,216 @@
+"""Latency/throughput benchmark for the generation and evaluation paths.
+
+By default an in-process fake OpenAI server (fake_openai_server.py) is started, so no quota is
+spent; pass --base-url to point at another server. Each operation is driven at increasing
+concurrency and p50/p95/p99 latency, time to first token (streaming), throughput and tokens
+are reported per level.
+
+    $ python benchmark.py --levels 1,4,16,32 --requests 64 --median-latency 0.3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+import prompt_engineer
+from evaluation import evaluate_record, evaluate_record_fused
+from fake_openai_server import FakeOpenAIConfig, start_server
+from llm_cache import CompletionCache, set_cache
+from prompt_engineer import generate_example, generate_prompt
+from rate_limiter import RateLimiter, set_limiter
+
+
+RUBRIC = "Likert: 1 - 5"
+INPUT_VARIABLES = ["input", "response", "context"]
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _generate_prompt(nonce):
+    generate_prompt(INPUT_VARIABLES, f"Benchmark criteria {nonce}", RUBRIC, bypass_cache=True)
+    return None
+
+
+def _generate_prompt_stream(nonce):
+    started = time.perf_counter()
+    first_token = None
+    for _ in generate_prompt(INPUT_VARIABLES, f"Benchmark criteria {nonce}", RUBRIC, bypass_cache=True, stream=True):
+        if first_token is None:
+            first_token = time.perf_counter() - started
+    return first_token
+
+
+def _generate_example(nonce):
+    generate_example(f"Benchmark criteria {nonce}", RUBRIC, INPUT_VARIABLES, "{}", bypass_cache=True)
+    return None
+
+
+BENCHMARK_METRIC = {
+    "name": "benchmark_metric",
+    "criteria": "Determines if the response is factually based on the provided context.",
+    "scoring_rubric": RUBRIC,
+    "input_variables": INPUT_VARIABLES,
+    "prompt": "Score how well the AI ASSISTANT ANSWER is grounded in the CONTEXT.",
+    "examples": [],
+}
+
+
+def _evaluate(nonce):
+    record = {"input": f"Question {nonce}?", "response": "An answer.", "context": "Some context. " * 200}
+    result = evaluate_record(BENCHMARK_METRIC, record, bypass_cache=True)
+    if result.get("error"):
+        raise RuntimeError(result["error"])
+    return None
+
+
+FUSED_METRICS = [
+    dict(BENCHMARK_METRIC, name=name) for name in ("groundedness_bench", "context_relevance_bench", "hallucination_bench")
+]
+
+
+def _evaluate_fused(nonce):
+    record = {"input": f"Question {nonce}?", "response": "An answer.", "context": "Some context. " * 200}
+    for result in evaluate_record_fused(FUSED_METRICS, record, bypass_cache=True):
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+    return None
+
+
+OPERATIONS = {
+    "generate_prompt": _generate_prompt,
+    "generate_prompt_stream": _generate_prompt_stream,
+    "generate_example": _generate_example,
+    "evaluate": _evaluate,
+    "evaluate_fused_x3": _evaluate_fused,
+}
+
+
+def _timed(fn, nonce):
+    started = time.perf_counter()
+    try:
+        first_token = fn(nonce)
+        error = None
+    except Exception as e:
+        first_token, error = None, f"{type(e).__name__}: {e}"
+    return time.perf_counter() - started, first_token, error
+
+
+def _server_stats(base_url):
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + "/stats", timeout=5) as response:
+            return json.load(response)
+    except Exception:
+        return None
+
+
+def run_level(operation, concurrency, requests, base_url):
+    fn = OPERATIONS[operation]
+    run_id = uuid.uuid4().hex[:8]
+    before = _server_stats(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Unique inputs per call so neither the cache nor request coalescing short-circuits the API
+        results = list(executor.map(lambda i: _timed(fn, f"{run_id}-{i}"), range(requests)))
+    wall = time.perf_counter() - started
+    after = _server_stats(base_url)
+
+    latencies = sorted(latency for latency, _, error in results if error is None)
+    first_tokens = sorted(ttft for _, ttft, error in results if error is None and ttft is not None)
+    errors = [error for _, _, error in results if error is not None]
+    tokens = None
+    if before and after:
+        tokens = (after["prompt_tokens"] + after["completion_tokens"]) - (before["prompt_tokens"] + before["completion_tokens"])
+
+    return {
+        "operation": operation,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttft_p50": percentile(first_tokens, 0.50),
+        "ttft_p95": percentile(first_tokens, 0.95),
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "tokens": tokens,
+        "tokens_per_second": tokens / wall if tokens is not None and wall else None,
+        "sample_error": errors[0] if errors else None,
+    }
+
+
+def format_row(row):
+    def ms(value):
+        return f"{value * 1000:8.0f}" if value is not None else f"{'-':>8}"
+
+    tokens_per_second = f"{row['tokens_per_second']:10.0f}" if row["tokens_per_second"] is not None else f"{'-':>10}"
+    return (f"{row['operation']:<24}{row['concurrency']:>5}{row['requests']:>6}{row['errors']:>6}"
+            f"{ms(row['p50'])}{ms(row['p95'])}{ms(row['p99'])}{ms(row['ttft_p50'])}"
+            f"{row['throughput']:9.1f}{tokens_per_second}")
+
+
+HEADER = (f"{'operation':<24}{'conc':>5}{'reqs':>6}{'errs':>6}{'p50ms':>8}{'p95ms':>8}{'p99ms':>8}{'ttft50':>8}"
+          f"{'req/s':>9}{'tok/s':>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prompt generation and evaluation under load.")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="comma-separated subset of " + ", ".join(OPERATIONS))
+    parser.add_argument("--levels", default="1,4,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="calls per operation and level")
+    parser.add_argument("--base-url", help="use an already running server instead of the in-process fake")
+    parser.add_argument("--rpm", type=int, default=0, help="requests/min limit for the rate limiter (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens/min limit for the rate limiter (0 = unlimited)")
+    parser.add_argument("--median-latency", type=float, default=0.3)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        config = FakeOpenAIConfig(args.median_latency, args.latency_sigma, args.error_rate,
+                                  tokens_per_second=args.tokens_per_second, seed=args.seed)
+        server, base_url = start_server(config=config)
+
+    prompt_engineer.set_client(OpenAI(api_key=os.environ.get("OPENAI_API_KEY", "fake"), base_url=base_url, max_retries=0))
+    set_limiter(RateLimiter(args.rpm, args.tpm))
+    cache_dir = tempfile.TemporaryDirectory()
+    set_cache(CompletionCache(os.path.join(cache_dir.name, "benchmark.sqlite3")))
+
+    rows = []
+    print(HEADER)
+    try:
+        for operation in args.operations.split(","):
+            for level in (int(level) for level in args.levels.split(",")):
+                row = run_level(operation.strip(), level, args.requests, base_url)
+                rows.append(row)
+                print(format_row(row), flush=True)
+    finally:
+        if server is not None:
+            server.shutdown()
+        cache_dir.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 1 if any(row["errors"] == row["requests"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
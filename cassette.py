@@ -0,0 +1,155 @@
+"""Record/replay of chat completions, for fast and reproducible runs without the network.
+
+A cassette is a single append-only file: a magic header followed by records of
+[32-byte request hash][4-byte big-endian length][zlib-compressed JSON]. Opening a cassette
+only reads the record headers to build a hash -> offset index; payloads are read on demand.
+
+Modes:
+    record  - always call the API, skipping the completion cache, and append every response
+    replay  - never call the API; a request that isn't on the cassette raises CassetteMiss
+    auto    - replay when the request is on the cassette, otherwise complete it as usual (from
+              the completion cache or the API) and record it
+
+Set LLM_CASSETTE=path (and optionally LLM_CASSETTE_MODE, default "auto") to enable it for the
+app and every batch tool, or call use_cassette() directly.
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+
+
+MAGIC = b"LLMCASS1"
+HEADER = struct.Struct(">32sI")
+MODES = ("record", "replay", "auto")
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    def __init__(self, path, mode="auto"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._index = {}
+        self._lock = threading.Lock()
+        self._reader = None
+        self._writer = None
+        self._end = 0
+
+        if os.path.exists(path):
+            self._load_index()
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette {path!r} does not exist")
+
+    def _load_index(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path!r} is not a cassette file")
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                digest, length = HEADER.unpack(header)
+                offset = f.tell()
+                if offset + length > size:
+                    break  # Truncated final record from an interrupted recording
+                self._index[digest] = (offset, length)
+                f.seek(length, os.SEEK_CUR)
+                self._end = offset + length
+        self._end = max(self._end, len(MAGIC))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return bytes.fromhex(key) in self._index
+
+    def replay(self, key):
+        # Recorded content for the request hash, None on a miss (CassetteMiss in replay mode)
+        if self.mode == "record":
+            return None
+        entry = self._index.get(bytes.fromhex(key))
+        if entry is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise CassetteMiss(f"Request {key[:12]} is not on cassette {self.path!r}")
+            return None
+
+        offset, length = entry
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            payload = self._reader.read(length)
+            self.hits += 1
+        return json.loads(zlib.decompress(payload))["content"]
+
+    def record(self, key, model, content):
+        if self.mode == "replay" or content is None:
+            return
+        digest = bytes.fromhex(key)
+        payload = zlib.compress(json.dumps({"model": model, "content": content}, ensure_ascii=False).encode("utf-8"))
+
+        with self._lock:
+            if self.mode == "auto" and digest in self._index:
+                return
+            if self._writer is None:
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                if not new_file and os.path.getsize(self.path) > self._end:
+                    os.truncate(self.path, self._end)  # Drop a torn record before appending
+                self._writer = open(self.path, "ab")
+                if new_file:
+                    self._writer.write(MAGIC)
+            self._writer.write(HEADER.pack(digest, len(payload)))
+            offset = self._writer.tell()
+            self._writer.write(payload)
+            self._writer.flush()
+            self._index[digest] = (offset, len(payload))
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            for handle in (self._reader, self._writer):
+                if handle is not None:
+                    handle.close()
+            self._reader = self._writer = None
+
+    def stats(self):
+        return {"mode": self.mode, "entries": len(self._index), "hits": self.hits,
+                "misses": self.misses, "recorded": self.recorded}
+
+
+_active_cassette = None
+_active_cassette_loaded = False
+_active_cassette_lock = threading.Lock()
+
+
+def use_cassette(path, mode="auto"):
+    """Activate a cassette for every completion in this process; pass path=None to turn it off."""
+    global _active_cassette, _active_cassette_loaded
+    with _active_cassette_lock:
+        if _active_cassette is not None:
+            _active_cassette.close()
+        _active_cassette = Cassette(path, mode) if path else None
+        _active_cassette_loaded = True
+        return _active_cassette
+
+
+def get_cassette():
+    global _active_cassette, _active_cassette_loaded
+    with _active_cassette_lock:
+        if not _active_cassette_loaded:
+            path = os.environ.get("LLM_CASSETTE")
+            if path:
+                _active_cassette = Cassette(path, os.environ.get("LLM_CASSETTE_MODE", "auto"))
+            _active_cassette_loaded = True
+        return _active_cassette
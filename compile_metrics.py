@@ -0,0 +1,160 @@
+"""Compile evaluation prompts for a catalogue of metric specs without running Streamlit.
+
+Each input line is a JSON metric spec:
+
+    {"name": "...", "criteria": "...", "scoring_rubric": "Likert: 1 - 5",
+     "input_variables": ["input", "response"], "examples": [{"input": "...", ...}]}
+
+Compiled metrics are appended to the output JSONL as soon as they finish, in the same
+shape the app deploys them in. Re-running with the same output file skips every metric
+that already compiled successfully, so an interrupted run resumes where it stopped. Specs
+that fail validation are recorded once and skipped on later runs; metrics whose generation
+failed are retried.
+
+    $ OPENAI_API_KEY=... python compile_metrics.py specs.jsonl compiled.jsonl --workers 16
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+
+from prompt_engineer import (
+    DEFAULT_MODEL,
+    INPUT_VARIABLE_OPTIONS,
+    format_examples,
+    generate_prompt,
+    is_valid_variable_name,
+    reserved_metrics,
+    run_bounded,
+)
+from rate_limiter import BATCH, request_priority
+from telemetry import start_metrics_server_from_env
+
+
+def read_specs(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_completed(output_path):
+    # (names that already have a prompt in the output, names with a recorded failure)
+    completed, failed = set(), set()
+    if not os.path.exists(output_path):
+        return completed, failed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn final line from a crashed run
+            if record.get("prompt") and not record.get("error"):
+                completed.add(record["name"])
+            elif record.get("error"):
+                failed.add(record.get("name", ""))
+    return completed, failed
+
+
+def validate_spec(spec):
+    name = spec.get("name", "")
+    if not name or not is_valid_variable_name(name):
+        return "invalid metric name"
+    if name.lower() in [m.lower() for m in reserved_metrics]:
+        return "metric name clashes with a base metric"
+    if not spec.get("criteria") or not spec.get("scoring_rubric"):
+        return "criteria and scoring_rubric are required"
+    input_variables = spec.get("input_variables", ["input", "response"])
+    if not {"input", "response"}.issubset(input_variables) or not set(input_variables).issubset(INPUT_VARIABLE_OPTIONS):
+        return f"unsupported input_variables: {input_variables}"
+    return None
+
+
+def compile_metric(spec, model=DEFAULT_MODEL, bypass_cache=False):
+    input_variables = spec.get("input_variables", ["input", "response"])
+    examples = spec.get("examples") or []
+    record = {
+        "name": spec.get("name", ""),
+        "criteria": spec.get("criteria", ""),
+        "scoring_rubric": spec.get("scoring_rubric", ""),
+        "input_variables": input_variables,
+        "prompt": "",
+        "examples": examples,
+    }
+
+    error = validate_spec(spec)
+    if error:
+        record["error"] = error
+        return record
+
+    rendered_examples = examples if isinstance(examples, str) else format_examples(examples, input_variables)
+    try:
+        prompt = generate_prompt(input_variables, record["criteria"], record["scoring_rubric"], rendered_examples,
+                                 bypass_cache=bypass_cache, model=model)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    if prompt:
+        record["prompt"] = prompt
+    else:
+        record["error"] = "No completion found."
+    return record
+
+
+def compile_catalogue(specs, output_path, workers=8, model=DEFAULT_MODEL, bypass_cache=False):
+    completed, failed = load_completed(output_path)
+    counts = {"compiled": 0, "failed": 0, "skipped": 0}
+
+    # Make sure a torn last line from a crash doesn't swallow the first new record
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    def pending_specs():
+        for spec in specs:
+            # An invalid spec fails the same way every time, so its recorded failure stands
+            if spec.get("name") in completed or (spec.get("name", "") in failed and validate_spec(spec)):
+                counts["skipped"] += 1
+            else:
+                yield spec
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline:
+            out.write("\n")
+
+        compile_one = functools.partial(compile_metric, model=model, bypass_cache=bypass_cache)
+        for record in run_bounded(compile_one, pending_specs(), workers):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["failed" if record.get("error") else "compiled"] += 1
+            print(f"compiled={counts['compiled']} failed={counts['failed']} skipped={counts['skipped']}",
+                  file=sys.stderr, flush=True)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile evaluation metric prompts from a JSONL catalogue.")
+    parser.add_argument("specs", help="input JSONL of metric specs")
+    parser.add_argument("output", help="output JSONL of compiled metrics (appended to and resumed from)")
+    parser.add_argument("--workers", type=int, default=8, help="maximum concurrent generations")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--bypass-cache", action="store_true", help="always request fresh prompts")
+    args = parser.parse_args(argv)
+
+    start_metrics_server_from_env()
+    # Batch work yields to interactive app calls sharing the same process-wide limiter
+    with request_priority(BATCH):
+        counts = compile_catalogue(read_specs(args.specs), args.output, workers=args.workers,
+                                   model=args.model, bypass_cache=args.bypass_cache)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
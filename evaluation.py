@@ -0,0 +1,672 @@
+"""Score a dataset with one or more deployed (or base) metrics.
+
+Records are streamed from JSONL or CSV with `input`, `response` and, depending on the
+metric, `reference` and `context` columns. Each record is rendered into a judge request
+using the metric's prompt, judged concurrently, and its SCORE/CRITIQUE parsed according
+to the metric's scoring rubric. Results are written to the output JSONL as they complete.
+
+With --fuse, metrics that read the same record fields are judged in one request per record so
+long contexts are only sent once; metrics whose block can't be parsed from the fused answer are
+re-judged alone.
+
+A metric with an "example_pool" (or every metric, with --example-pool) is judged with the
+few-shot examples from that pool most similar to each record (see example_pool.py), up to
+"pool_k" examples within "pool_token_budget" tokens. Such metrics are never fused.
+
+Every judge request is fitted to the metric's "token_budget" (default: the model's context
+window less room for the answer): pool examples are dropped first, then oversized context and
+reference fields are cut with a marker. --token-report writes the per-record token breakdown
+(system/template/examples/record) instead of calling the API.
+
+A metric with "chunk_tokens" (or every metric, with --chunk-tokens) whose context is longer
+than that is judged map-reduce style instead of having its context cut: the context is split
+into chunks overlapping by "chunk_overlap" tokens, each chunk is judged in parallel as if it
+were the whole context, and the chunk scores are reduced by "chunk_reduce" (max by default:
+the best-supported chunk decides, so a chunk at the top of the rubric ends the record early;
+min: the worst chunk decides; mean: the average, rounded to the rubric). Such metrics are
+never fused.
+
+A metric with a "cascade" of models (or every metric, with --cascade) is judged by the first,
+cheapest model and escalated to the next one only when the answer is malformed, the judge's
+self-reported confidence is below "escalate_below", or the score is near the middle of the
+rubric. A metric with a "heuristic" (see judge_heuristics.py) is scored locally before any
+model. Results record the model that decided each score and why earlier stages escalated (for
+a chunked record, the furthest stage any chunk needed and each chunk's escalations); cascaded
+metrics are never fused.
+
+    $ OPENAI_API_KEY=... python evaluation.py groundedness,context_relevance dataset.jsonl results.jsonl \
+          --metrics compiled.jsonl --concurrency 32 --fuse
+"""
+import argparse
+import contextvars
+import csv
+import json
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from example_pool import DEFAULT_K, DEFAULT_TOKEN_BUDGET, get_example_pool
+from judge_heuristics import HEURISTICS
+from metric_store import MetricStore
+from prompt_budget import count_tokens, default_budget, fit_fields, split_tokens, token_breakdown
+from prompt_engineer import (
+    DEFAULT_MODEL,
+    create_completion,
+    format_examples,
+    generate_prompt,
+    reserved_metric_info,
+    run_bounded,
+)
+from rate_limiter import BATCH, request_priority
+from telemetry import get_registry, operation, start_metrics_server_from_env
+
+
+# Labels in the order used by the "Example Format" blocks of the prompt templates
+RECORD_FIELD_LABELS = [
+    ("input", "QUESTION"),
+    ("context", "CONTEXT"),
+    ("reference", "REFERENCE RESPONSE"),
+    ("response", "AI ASSISTANT ANSWER"),
+]
+# Fields that may be cut to fit a token budget, in the order they are cut
+TRUNCATABLE_FIELDS = ("context", "reference")
+# Chunked evaluation: tokens shared by consecutive chunks, and chunks judged at once per record
+DEFAULT_CHUNK_OVERLAP = 200
+CHUNK_WORKERS = 4
+CHUNK_REDUCERS = ("max", "min", "mean")
+CHUNK_NOTE = "[Excerpt {} of {} from a longer context]\n"
+# Cascades: escalate below this self-reported confidence, or within this share of the scale around its middle
+DEFAULT_ESCALATE_BELOW = 0.7
+BOUNDARY_MARGIN = 0.1
+
+RUBRIC_PATTERN = re.compile(r"^\s*(\w+)\s*:\s*([-+]?\d+(?:\.\d+)?)\s*(?:-|or|to)\s*([-+]?\d+(?:\.\d+)?)", re.IGNORECASE)
+SCORE_PATTERN = re.compile(r"SCORE\W*?:\W*?([-+]?\d+(?:\.\d+)?)", re.IGNORECASE)
+CRITIQUE_PATTERN = re.compile(r"CRITIQUE\W*?:\**\s*(.*)", re.IGNORECASE | re.DOTALL)
+CONFIDENCE_PATTERN = re.compile(r"CONFIDENCE\W*?:\W*?(\d+(?:\.\d+)?)\s*(%?)", re.IGNORECASE)
+FUSED_BLOCK_PATTERN = re.compile(r"\[METRIC:\s*([A-Za-z_][A-Za-z0-9_]*)\s*\]", re.IGNORECASE)
+
+FUSED_SYSTEM_PROMPT = (
+    "You are an evaluator scoring one AI assistant answer against several independent metrics. "
+    "Each metric's evaluation instructions follow under its own heading. Apply each metric separately "
+    "and do not let one metric's judgement influence another."
+)
+
+
+def parse_scoring_rubric(scoring_rubric):
+    # "Likert: 1 - 5" -> ("likert", 1, 5), "Binary: 0 or 1" -> ("binary", 0, 1), "Float: 0 - 1" -> ("float", 0.0, 1.0)
+    match = RUBRIC_PATTERN.match(scoring_rubric or "")
+    if not match:
+        raise ValueError(f"Unrecognised scoring rubric: {scoring_rubric!r}")
+    kind = match.group(1).lower()
+    low, high = float(match.group(2)), float(match.group(3))
+    if kind == "float":
+        return kind, low, high
+    return kind, int(low), int(high)
+
+
+def parse_judgement(text, scoring_rubric):
+    # Returns (score, critique); raises ValueError if the output doesn't follow the rubric
+    kind, low, high = parse_scoring_rubric(scoring_rubric)
+    score_match = SCORE_PATTERN.search(text or "")
+    if not score_match:
+        raise ValueError("No SCORE found in judge output")
+
+    score = float(score_match.group(1))
+    if kind != "float":
+        if not score.is_integer():
+            raise ValueError(f"Non-integer score {score} for {scoring_rubric}")
+        score = int(score)
+    if not low <= score <= high:
+        raise ValueError(f"Score {score} outside {scoring_rubric}")
+
+    critique_match = CRITIQUE_PATTERN.search(text, score_match.end())
+    if not critique_match:
+        critique_match = CRITIQUE_PATTERN.search(text)
+    critique = critique_match.group(1).strip() if critique_match else ""
+    return score, critique
+
+
+def _render_fields(input_variables, record):
+    parts = []
+    for field, label in RECORD_FIELD_LABELS:
+        if field in input_variables:
+            parts.append(f"{label}:\n{record.get(field, '')}\n")
+    parts.append("—\n")
+    return parts
+
+
+def render_record(metric, record, confidence=False):
+    if metric.get("bundle") is not None and not confidence:
+        # Metrics loaded from a bundle render from its pre-compiled template, a join of slices
+        return metric["bundle"].render(metric["name"], record)
+    parts = _render_fields(metric["input_variables"], record)
+    if confidence:
+        # Asked of the cheaper stages of a cascade, to decide whether to escalate
+        parts.append(f"Respond in exactly this format, with the score on the {metric['scoring_rubric']} scale and "
+                     "your confidence in it from 0 to 1:\nSCORE: <score>\nCONFIDENCE: <confidence>\nCRITIQUE: <critique>")
+    else:
+        parts.append(f"Respond in exactly this format, with the score on the {metric['scoring_rubric']} scale:\n"
+                     "SCORE: <score>\nCRITIQUE: <critique>")
+    return "\n".join(parts)
+
+
+def parse_confidence(text):
+    match = CONFIDENCE_PATTERN.search(text or "")
+    if not match:
+        return None
+    value = float(match.group(1))
+    return value / 100 if match.group(2) or value > 1 else value
+
+
+def select_pool_examples(metric, record):
+    if not metric.get("example_pool"):
+        return []
+    pool = get_example_pool(metric["example_pool"])
+    return pool.select(record, metric.get("pool_k", DEFAULT_K), metric.get("pool_token_budget", DEFAULT_TOKEN_BUDGET))
+
+
+def _examples_block(examples, input_variables):
+    if not examples:
+        return ""
+    return f"Few shot examples: \n\n{format_examples(examples, input_variables)}—\n\n"
+
+
+def _fit_record(record, input_variables, examples, fixed_tokens, budget, model):
+    # Drops the least similar examples while they would force a record field to be cut, then cuts fields
+    fields = {field: str(record.get(field, "")) for field, _ in RECORD_FIELD_LABELS if field in input_variables}
+    record_tokens = sum(count_tokens(value, model) for value in fields.values())
+    while True:
+        examples_text = _examples_block(examples, input_variables)
+        available = budget - fixed_tokens - count_tokens(examples_text, model)
+        if not examples or record_tokens <= available:
+            break
+        examples = examples[:-1]
+    fields, truncated = fit_fields(fields, available, TRUNCATABLE_FIELDS, model)
+    return fields, examples_text, truncated
+
+
+def assemble_judge_messages(metric, record, model=DEFAULT_MODEL, confidence=False):
+    """Judge messages fitted to the metric's token budget, and a report of their token breakdown."""
+    budget = metric.get("token_budget") or default_budget(model)
+    template = render_record(metric, {}, confidence)
+    fixed_tokens = token_breakdown({"system": metric["prompt"], "template": template}, model)["total"]
+    fields, examples_text, truncated = _fit_record(record, metric["input_variables"], select_pool_examples(metric, record),
+                                                  fixed_tokens, budget, model)
+    messages = [
+        {"role": "system", "content": metric["prompt"]},
+        # Examples go ahead of the record so the metric prompt stays a shared prefix across records
+        {"role": "user", "content": examples_text + render_record(metric, fields, confidence)},
+    ]
+    report = token_breakdown({"system": metric["prompt"], "template": template, "examples": examples_text,
+                              "record": "".join(fields.values())}, model)
+    report.update(budget=budget, truncated=truncated)
+    return messages, report
+
+
+def build_judge_messages(metric, record, model=DEFAULT_MODEL):
+    return assemble_judge_messages(metric, record, model)[0]
+
+
+def _judged_alone(metric):
+    return any(metric.get(key) for key in ("example_pool", "chunk_tokens", "cascade", "heuristic"))
+
+
+def plan_metric_groups(metrics, max_fused=4):
+    # Only metrics that read exactly the same record fields are fused, so each sees the record as it
+    # would alone; metrics with a per-record example pool, chunked contexts or a cascade are judged alone
+    alone = [[metric] for metric in metrics if _judged_alone(metric)]
+    by_fields = {}
+    for metric in sorted((metric for metric in metrics if not _judged_alone(metric)), key=lambda metric: metric["name"]):
+        by_fields.setdefault(tuple(sorted(set(metric["input_variables"]))), []).append(metric)
+    groups = []
+    for fields in sorted(by_fields):
+        same = by_fields[fields]
+        groups.extend(same[i:i + max_fused] for i in range(0, len(same), max_fused))
+    return groups + alone
+
+
+def render_fused_record(metrics, record):
+    input_variables = set().union(*(metric["input_variables"] for metric in metrics))
+    parts = _render_fields(input_variables, record)
+    instructions = ["Respond with one block per metric, in this order and in exactly this format:"]
+    for metric in metrics:
+        instructions.append(f"[METRIC: {metric['name']}]\nSCORE: <score on the {metric['scoring_rubric']} scale>\n"
+                            "CRITIQUE: <critique>")
+    parts.append("\n\n".join(instructions))
+    return "\n".join(parts)
+
+
+def assemble_fused_messages(metrics, record, model=DEFAULT_MODEL):
+    """Fused judge messages fitted to the smallest token budget of the group, and their token breakdown."""
+    budget = min(metric.get("token_budget") or default_budget(model) for metric in metrics)
+    system = "\n\n".join([FUSED_SYSTEM_PROMPT] + [f"### METRIC: {metric['name']}\n\n{metric['prompt']}" for metric in metrics])
+    template = render_fused_record(metrics, {})
+    fixed_tokens = token_breakdown({"system": system, "template": template}, model)["total"]
+    input_variables = set().union(*(metric["input_variables"] for metric in metrics))
+    fields, _, truncated = _fit_record(record, input_variables, [], fixed_tokens, budget, model)
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": render_fused_record(metrics, fields)},
+    ]
+    report = token_breakdown({"system": system, "template": template, "examples": "",
+                              "record": "".join(fields.values())}, model)
+    report.update(budget=budget, truncated=truncated)
+    return messages, report
+
+
+def build_fused_messages(metrics, record, model=DEFAULT_MODEL):
+    return assemble_fused_messages(metrics, record, model)[0]
+
+
+def parse_fused_judgement(text, metrics):
+    # Returns {metric name: (score, critique)} for every metric whose block parsed cleanly
+    text = text or ""
+    matches = list(FUSED_BLOCK_PATTERN.finditer(text))
+    blocks = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        blocks[match.group(1)] = text[match.end():end]
+
+    parsed = {}
+    for metric in metrics:
+        block = blocks.get(metric["name"])
+        if block is None:
+            continue
+        try:
+            parsed[metric["name"]] = parse_judgement(block, metric["scoring_rubric"])
+        except ValueError:
+            continue
+    return parsed
+
+
+def load_metrics(path):
+    # Reads deployed metrics exported from the app, produced by compile_metrics.py, the app's metric store or a bundle
+    if path.endswith((".sqlite3", ".db")):
+        return MetricStore(path).all()
+    if path.endswith(".bundle"):
+        from metric_bundle import BundleMetrics, MetricBundle  # metric_bundle itself builds on this module
+        # Decoded per metric on first use; the bundle stays open until close_metrics
+        return BundleMetrics(MetricBundle(path))
+    metrics = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            metric = json.loads(line)
+            if metric.get("prompt") and not metric.get("error"):
+                metrics[metric["name"]] = metric
+    return metrics
+
+
+def close_metrics(metrics):
+    """Close the bundle metrics from load_metrics were read from, if any."""
+    if hasattr(metrics, "close"):
+        metrics.close()
+
+
+def resolve_metric(name, metrics=None, model=DEFAULT_MODEL, bypass_cache=False):
+    if metrics and name in metrics:
+        return metrics[name]
+    if name in reserved_metric_info:
+        # Base metrics have no stored prompt; generate one (it lands in the completion cache)
+        info = reserved_metric_info[name]
+        prompt = generate_prompt(info["input_variables"], info["criteria"], info["scoring_rubric"],
+                                 bypass_cache=bypass_cache, model=model)
+        if not prompt:
+            raise ValueError(f"Could not generate a prompt for base metric {name!r}")
+        return {"name": name, **info, "prompt": prompt, "examples": []}
+    raise KeyError(f"Unknown metric: {name!r}")
+
+
+def iter_records(path):
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def evaluate_record(metric, record, model=DEFAULT_MODEL, bypass_cache=False):
+    result = {"metric": metric["name"], "score": None, "critique": None}
+    output = None
+    try:
+        chunks = chunk_records(metric, record, model)
+        if chunks:
+            return evaluate_record_chunked(metric, chunks, model=model, bypass_cache=bypass_cache)
+        if is_cascaded(metric):
+            with operation("evaluate"):
+                result["score"], result["critique"], details = judge_cascade(metric, record, model, bypass_cache)
+            result["model"] = details["model"]
+            if details["escalations"]:
+                result["escalations"] = details["escalations"]
+            if details["truncated"]:
+                result["truncated"] = details["truncated"]
+            return result
+        with operation("evaluate"):
+            messages, report = assemble_judge_messages(metric, record, model)
+            if report["truncated"]:
+                result["truncated"] = report["truncated"]
+            output = create_completion(messages, model=model, bypass_cache=bypass_cache)
+            result["score"], result["critique"] = parse_judgement(output, metric["scoring_rubric"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        if output is not None:
+            result["raw_output"] = output
+    return result
+
+
+def is_cascaded(metric):
+    return bool(metric.get("cascade") or metric.get("heuristic"))
+
+
+def escalation_reason(metric, score, confidence):
+    # Why a cheaper stage's judgement should go to the next stage, or None to keep it
+    _, low, high = parse_scoring_rubric(metric["scoring_rubric"])
+    if confidence is None:
+        return "no_confidence"
+    if confidence < metric.get("escalate_below", DEFAULT_ESCALATE_BELOW):
+        return "low_confidence"
+    if abs(score - (low + high) / 2) <= BOUNDARY_MARGIN * (high - low):
+        return "boundary"
+    return None
+
+
+def judge_cascade(metric, record, model=DEFAULT_MODEL, bypass_cache=False):
+    """(score, critique, details) from the first stage of the metric's cascade that settles the record.
+
+    Stages are the metric's heuristic, if any, then its "cascade" models (default: just model);
+    details name the deciding stage and why each earlier one escalated.
+    """
+    _, low, high = parse_scoring_rubric(metric["scoring_rubric"])
+    stages = [metric["heuristic"]] if metric.get("heuristic") else []
+    stages += list(metric.get("cascade") or [model])
+    escalations, truncated = [], []
+    for i, stage in enumerate(stages):
+        last = i == len(stages) - 1
+        if i == 0 and metric.get("heuristic"):
+            # Always followed by at least one model
+            judged = HEURISTICS[stage](record)
+            if judged is None:
+                reason = "declined"
+            else:
+                score, critique, confidence = judged
+                reason = escalation_reason(metric, score, confidence) if low <= score <= high else "out_of_range"
+        else:
+            messages, report = assemble_judge_messages(metric, record, stage, confidence=not last)
+            truncated = report["truncated"]
+            output = create_completion(messages, model=stage, bypass_cache=bypass_cache)
+            try:
+                score, critique = parse_judgement(output, metric["scoring_rubric"])
+            except ValueError:
+                if last:
+                    raise
+                reason = "malformed"
+            else:
+                reason = None if last else escalation_reason(metric, score, parse_confidence(output))
+        if reason is None:
+            return score, critique, {"model": stage, "escalations": escalations, "truncated": truncated}
+        escalations.append({"stage": stage, "reason": reason})
+        get_registry().inc("llm_escalations_total", metric=metric["name"], stage=stage, reason=reason)
+
+
+def chunk_records(metric, record, model=DEFAULT_MODEL):
+    """One record per context chunk if the metric is chunked and the context is too long for a chunk, else None."""
+    chunk_tokens = metric.get("chunk_tokens")
+    if not chunk_tokens or "context" not in metric["input_variables"]:
+        return None
+    context = str(record.get("context", ""))
+    if count_tokens(context, model) <= chunk_tokens:
+        return None
+    overlap = min(metric.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP), chunk_tokens // 4)
+    chunks = split_tokens(context, chunk_tokens, overlap, model)
+    return [{**record, "context": CHUNK_NOTE.format(i, len(chunks)) + chunk} for i, chunk in enumerate(chunks, 1)]
+
+
+def reduce_chunk_judgements(judgements, scoring_rubric, reduce="max"):
+    # judgements: [(chunk number, score, critique)] -> (score, critique), following the rubric's scale
+    kind, low, high = parse_scoring_rubric(scoring_rubric)
+    if reduce == "mean":
+        mean = sum(score for _, score, _ in judgements) / len(judgements)
+        score = mean if kind == "float" else min(high, max(low, int(mean + 0.5)))
+        chunk, _, critique = min(judgements, key=lambda judgement: abs(judgement[1] - mean))
+        scores = ", ".join(str(judgement[1]) for judgement in sorted(judgements))
+        return score, f"Mean of {len(judgements)} chunk scores ({scores}). Chunk {chunk}: {critique}"
+    # The highest (or lowest) score; the earliest chunk on ties
+    if reduce == "max":
+        chunk, score, critique = max(judgements, key=lambda judgement: (judgement[1], -judgement[0]))
+    else:
+        chunk, score, critique = min(judgements, key=lambda judgement: (judgement[1], judgement[0]))
+    return score, f"Decided by chunk {chunk}: {critique}"
+
+
+def evaluate_record_chunked(metric, records, model=DEFAULT_MODEL, bypass_cache=False):
+    # Map: judge the chunks in parallel, stopping once a chunk settles the reduced score.
+    # Reduce: combine the chunk scores according to the metric's rubric.
+    reduce = metric.get("chunk_reduce", "max")
+    if reduce not in CHUNK_REDUCERS:
+        raise ValueError(f"Unknown chunk_reduce {reduce!r}, expected one of {CHUNK_REDUCERS}")
+    _, low, high = parse_scoring_rubric(metric["scoring_rubric"])
+    decisive = {"max": high, "min": low}.get(reduce)
+
+    def judge(number, chunk_record):
+        # (chunk number, score, critique, cascade details or None)
+        if is_cascaded(metric):
+            return (number,) + judge_cascade(metric, chunk_record, model, bypass_cache)
+        messages, _ = assemble_judge_messages(metric, chunk_record, model)
+        output = create_completion(messages, model=model, bypass_cache=bypass_cache)
+        return (number,) + parse_judgement(output, metric["scoring_rubric"]) + (None,)
+
+    result = {"metric": metric["name"], "score": None, "critique": None, "chunks": len(records)}
+    judgements, errors = [], []
+    with operation("evaluate_chunked"):
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(records))) as executor:
+            pending = {executor.submit(context.copy().run, judge, number, chunk_record)
+                       for number, chunk_record in enumerate(records, 1)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        judgements.append(future.result())
+                    except Exception as e:
+                        errors.append(f"{type(e).__name__}: {e}")
+                if decisive is not None and any(judgement[1] == decisive for judgement in judgements):
+                    # Chunks not yet started are dropped; those in flight are left to finish
+                    for future in pending:
+                        future.cancel()
+                    break
+    result["chunks_scored"] = len(judgements)
+    if errors:
+        result["chunk_errors"] = len(errors)
+    if not judgements:
+        result["error"] = errors[0] if errors else "No chunks were judged"
+        return result
+    result["score"], result["critique"] = reduce_chunk_judgements([judgement[:3] for judgement in judgements],
+                                                                  metric["scoring_rubric"], reduce)
+    if is_cascaded(metric):
+        # The furthest cascade stage any chunk needed, and every chunk's escalations, as for an unchunked record
+        stages = list(metric.get("cascade") or [model])
+        models = {details["model"] for *_, details in judgements}
+        result["model"] = max(models, key=lambda stage: stages.index(stage) if stage in stages else -1)
+        escalations = [{"chunk": number, **escalation} for number, *_, details in sorted(judgements)
+                       for escalation in details["escalations"]]
+        if escalations:
+            result["escalations"] = escalations
+    return result
+
+
+def evaluate_record_fused(metrics, record, model=DEFAULT_MODEL, bypass_cache=False):
+    # One judge call for the whole group; metrics missing from the fused answer fall back to their own call
+    if len(metrics) == 1:
+        return [evaluate_record(metrics[0], record, model=model, bypass_cache=bypass_cache)]
+
+    truncated = []
+    try:
+        with operation("evaluate_fused"):
+            messages, report = assemble_fused_messages(metrics, record, model)
+            truncated = report["truncated"]
+            output = create_completion(messages, model=model, bypass_cache=bypass_cache)
+            parsed = parse_fused_judgement(output, metrics)
+    except Exception:
+        parsed = {}
+
+    results = []
+    for metric in metrics:
+        if metric["name"] in parsed:
+            score, critique = parsed[metric["name"]]
+            result = {"metric": metric["name"], "score": score, "critique": critique}
+            if truncated:
+                result["truncated"] = truncated
+        else:
+            result = evaluate_record(metric, record, model=model, bypass_cache=bypass_cache)
+        result["fused"] = metric["name"] in parsed
+        results.append(result)
+    return results
+
+
+def run_evaluation(metrics, records, out, concurrency=16, model=DEFAULT_MODEL, bypass_cache=False,
+                   fuse=False, max_fused=4, log=sys.stderr):
+    # Results are written as they complete, one line per (record, metric), tagged with the
+    # record's position (and id, if any)
+    if isinstance(metrics, dict):
+        metrics = [metrics]
+    groups = plan_metric_groups(metrics, max_fused) if fuse else [[metric] for metric in metrics]
+
+    def evaluate_one(indexed_record):
+        index, record = indexed_record
+        results = []
+        for group in groups:
+            if fuse:
+                results.extend(evaluate_record_fused(group, record, model=model, bypass_cache=bypass_cache))
+            else:
+                results.append(evaluate_record(group[0], record, model=model, bypass_cache=bypass_cache))
+        for result in results:
+            result["index"] = index
+            if "id" in record:
+                result["id"] = record["id"]
+        return results
+
+    counts = {"records": 0, "scored": 0, "failed": 0, "escalated": 0}
+    started = last_report = time.monotonic()
+    for results in run_bounded(evaluate_one, enumerate(records), concurrency):
+        counts["records"] += 1
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            counts["failed" if result.get("error") else "scored"] += 1
+            counts["escalated"] += bool(result.get("escalations"))
+
+        now = time.monotonic()
+        if log and now - last_report >= 1:
+            last_report = now
+            out.flush()
+            print(f"records={counts['records']} scored={counts['scored']} failed={counts['failed']} "
+                  f"({counts['records'] / (now - started):.1f} records/s)", file=log, flush=True)
+
+    out.flush()
+    counts["seconds"] = time.monotonic() - started
+    return counts
+
+
+def report_tokens(metrics, records, out, model=DEFAULT_MODEL, fuse=False, max_fused=4):
+    # Dry run: one line per (record, request) with the token breakdown, no API calls
+    if isinstance(metrics, dict):
+        metrics = [metrics]
+    groups = plan_metric_groups(metrics, max_fused) if fuse else [[metric] for metric in metrics]
+    totals = {"records": 0, "requests": 0, "tokens": 0, "truncated": 0, "over_budget": 0}
+    for index, record in enumerate(records):
+        totals["records"] += 1
+        for group in groups:
+            line = {"index": index, "metrics": [metric["name"] for metric in group]}
+            try:
+                chunks = chunk_records(group[0], record, model) if len(group) == 1 else None
+                if len(group) > 1:
+                    _, report = assemble_fused_messages(group, record, model)
+                elif chunks:
+                    # Every chunk is a request; reported as their sum
+                    reports = [assemble_judge_messages(group[0], chunk, model)[1] for chunk in chunks]
+                    report = {key: sum(r[key] for r in reports) for key in reports[0] if key not in ("budget", "truncated")}
+                    report.update(budget=reports[0]["budget"], chunks=len(chunks),
+                                  truncated=sorted({field for r in reports for field in r["truncated"]}))
+                else:
+                    _, report = assemble_judge_messages(group[0], record, model)
+                line.update(report)
+                totals["tokens"] += report["total"]
+                totals["truncated"] += bool(report["truncated"])
+            except ValueError as e:
+                line["error"] = str(e)
+                totals["over_budget"] += 1
+            totals["requests"] += line.get("chunks", 1)
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+    out.flush()
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a dataset with an evaluation metric.")
+    parser.add_argument("metric", help="comma-separated deployed metric names (see --metrics) and/or base metrics")
+    parser.add_argument("dataset", help="records as JSONL or CSV")
+    parser.add_argument("output", help="output JSONL of scores")
+    parser.add_argument("--metrics", help="deployed metrics: JSONL (app export or compile_metrics.py output) the app's metric store or a metric bundle")
+    parser.add_argument("--concurrency", type=int, default=16, help="maximum concurrent judge calls")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--bypass-cache", action="store_true", help="always request fresh judgements")
+    parser.add_argument("--fuse", action="store_true", help="judge several metrics per request")
+    parser.add_argument("--max-fused", type=int, default=4, help="maximum metrics per fused request")
+    parser.add_argument("--example-pool", help="few-shot example pool for metrics that don't set their own")
+    parser.add_argument("--pool-k", type=int, help="examples per record from the pool")
+    parser.add_argument("--pool-token-budget", type=int, help="token budget for the pool examples")
+    parser.add_argument("--token-budget", type=int, help="prompt token budget for metrics that don't set their own")
+    parser.add_argument("--token-report", action="store_true", help="write each request's token breakdown instead of scoring")
+    parser.add_argument("--chunk-tokens", type=int, help="judge contexts longer than this in chunks of this many tokens")
+    parser.add_argument("--chunk-overlap", type=int, help=f"tokens shared by consecutive chunks (default {DEFAULT_CHUNK_OVERLAP})")
+    parser.add_argument("--chunk-reduce", choices=CHUNK_REDUCERS, help="how chunk scores combine (default max)")
+    parser.add_argument("--cascade", help="comma-separated models, cheapest first, for metrics without their own cascade")
+    parser.add_argument("--escalate-below", type=float, help=f"escalate cascade judgements below this confidence (default {DEFAULT_ESCALATE_BELOW})")
+    args = parser.parse_args(argv)
+
+    start_metrics_server_from_env()
+    deployed = load_metrics(args.metrics) if args.metrics else None
+    try:
+        with request_priority(BATCH):
+            metrics = [resolve_metric(name.strip(), deployed, model=args.model, bypass_cache=args.bypass_cache)
+                       for name in args.metric.split(",") if name.strip()]
+            for i, metric in enumerate(metrics):
+                overrides = {key: value for key, value in (("example_pool", args.example_pool), ("pool_k", args.pool_k),
+                                                           ("pool_token_budget", args.pool_token_budget),
+                                                           ("token_budget", args.token_budget),
+                                                           ("chunk_tokens", args.chunk_tokens), ("chunk_overlap", args.chunk_overlap),
+                                                           ("chunk_reduce", args.chunk_reduce),
+                                                           ("cascade", args.cascade and [model.strip() for model in args.cascade.split(",")]),
+                                                           ("escalate_below", args.escalate_below))
+                             if value is not None and not metric.get(key)}
+                if overrides:
+                    metrics[i] = {**metric, **overrides}
+            with open(args.output, "w", encoding="utf-8") as out:
+                if args.token_report:
+                    totals = report_tokens(metrics, iter_records(args.dataset), out, model=args.model,
+                                           fuse=args.fuse, max_fused=args.max_fused)
+                    print(f"records={totals['records']} requests={totals['requests']} prompt_tokens={totals['tokens']} "
+                          f"truncated={totals['truncated']} over_budget={totals['over_budget']}", file=sys.stderr)
+                    return 1 if totals["over_budget"] else 0
+                counts = run_evaluation(metrics, iter_records(args.dataset), out, concurrency=args.concurrency,
+                                        model=args.model, bypass_cache=args.bypass_cache,
+                                        fuse=args.fuse, max_fused=args.max_fused)
+    finally:
+        close_metrics(deployed)
+
+    print(f"records={counts['records']} scored={counts['scored']} failed={counts['failed']} in {counts['seconds']:.1f}s "
+          f"({counts['records'] / counts['seconds'] if counts['seconds'] else 0:.1f} records/s)", file=sys.stderr)
+    if any(is_cascaded(metric) for metric in metrics):
+        judged = counts["scored"] + counts["failed"]
+        print(f"escalated={counts['escalated']} ({counts['escalated'] / judged if judged else 0:.1%} of judgements)", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Retrieval of few-shot examples from a large labeled pool.
+
+A pool is a SQLite file of labeled examples plus a BM25 inverted index over their input,
+response and context, stored alongside them: postings, document lengths and document
+frequencies are updated as examples are added, so opening a pool reads nothing up front. A
+query only reads the postings of its most discriminative terms and answers in milliseconds
+even for pools of tens of thousands of examples. Examples can be added at any time;
+duplicates (by content) are ignored.
+
+    $ python example_pool.py add pool.sqlite3 labeled.jsonl
+    $ python example_pool.py query pool.sqlite3 "Is the capital of France Paris?" -k 3
+
+A deployed metric uses a pool when it has an "example_pool" path (see evaluation.py); each
+record is then judged with the top-k most similar examples that fit the token budget.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+
+INDEXED_FIELDS = ("input", "response", "context")
+EXAMPLE_FIELDS = ("input", "response", "reference", "context", "score", "critique")
+
+DEFAULT_K = 3
+DEFAULT_TOKEN_BUDGET = 1500
+# Only the most discriminative query terms are scored; long contexts would otherwise walk most postings
+MAX_QUERY_TERMS = 32
+# Query terms looked up per statement, under SQLite's bound-parameter limit
+QUERY_BATCH = 500
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text or "").lower())
+
+
+def example_tokens(example):
+    # Same ~4 characters per token estimate as the rate limiter, plus the per-field labels
+    return sum(len(str(example.get(field, ""))) for field in EXAMPLE_FIELDS) // 4 + 12
+
+
+def _content_hash(example):
+    payload = json.dumps({field: str(example.get(field, "")) for field in EXAMPLE_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExamplePool:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS examples (
+                    id INTEGER PRIMARY KEY,
+                    content_hash TEXT UNIQUE NOT NULL,
+                    example TEXT NOT NULL
+                )"""
+            )
+            # The BM25 index: each example's length in terms, its postings (carrying the length, so scoring
+            # reads only postings), and each term's document frequency
+            conn.execute("CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, length INTEGER NOT NULL)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (term, id)
+                ) WITHOUT ROWID"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS index_stats (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                         "documents INTEGER NOT NULL, total_length INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO index_stats (id, documents, total_length) VALUES (0, 0, 0)")
+            # Pools written before the index was stored are indexed once, here
+            self._index(conn, [(example_id, json.loads(example)) for example_id, example in conn.execute(
+                "SELECT id, example FROM examples WHERE id NOT IN (SELECT id FROM documents) ORDER BY id"
+            )])
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT documents FROM index_stats").fetchone()[0]
+
+    def _index(self, conn, examples):
+        # Index (id, example) pairs with one batch of writes
+        documents, postings, frequencies = [], [], Counter()
+        for example_id, example in examples:
+            terms = Counter()
+            for field in INDEXED_FIELDS:
+                terms.update(tokenize(example.get(field)))
+            length = sum(terms.values())
+            documents.append((example_id, length))
+            postings.extend((term, example_id, tf, length) for term, tf in terms.items())
+            frequencies.update(terms.keys())
+        if not documents:
+            return
+        conn.executemany("INSERT INTO documents (id, length) VALUES (?, ?)", documents)
+        conn.executemany("INSERT INTO postings (term, id, tf, length) VALUES (?, ?, ?, ?)", sorted(postings))
+        conn.executemany("INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                         frequencies.items())
+        conn.execute("UPDATE index_stats SET documents = documents + ?, total_length = total_length + ?",
+                     (len(documents), sum(length for _, length in documents)))
+
+    def add(self, examples):
+        """Add labeled examples (dicts with input/response/... and score/critique); returns how many were new."""
+        new = []
+        with self._lock, self._connect() as conn:
+            for example in examples:
+                example = {field: str(example[field]) for field in EXAMPLE_FIELDS if example.get(field) is not None}
+                cursor = conn.execute("INSERT OR IGNORE INTO examples (content_hash, example) VALUES (?, ?)",
+                                      (_content_hash(example), json.dumps(example, ensure_ascii=False)))
+                if cursor.rowcount:
+                    new.append((cursor.lastrowid, example))
+            self._index(conn, new)
+        return len(new)
+
+    def examples(self, start=0):
+        """Examples in insertion order from position start, e.g. to extend an index built earlier."""
+        with self._connect() as conn:
+            return [json.loads(example) for example, in
+                    conn.execute("SELECT example FROM examples ORDER BY id LIMIT -1 OFFSET ?", (start,))]
+
+    def search(self, record, k=DEFAULT_K):
+        """Top-k (score, example) pairs by BM25 similarity of the record's input/response/context."""
+        query = set()
+        for field in INDEXED_FIELDS:
+            query.update(tokenize(record.get(field)))
+        if not query:
+            return []
+
+        with self._connect() as conn:
+            n, total_length = conn.execute("SELECT documents, total_length FROM index_stats").fetchone()
+            if not n:
+                return []
+            average_length = total_length / n
+
+            query = sorted(query)
+            frequencies = []
+            for i in range(0, len(query), QUERY_BATCH):
+                batch = query[i:i + QUERY_BATCH]
+                frequencies.extend(conn.execute(
+                    f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch))
+            weighted = [(math.log(1 + (n - df + 0.5) / (df + 0.5)), term) for term, df in frequencies]
+            weighted = heapq.nlargest(MAX_QUERY_TERMS, weighted)
+
+            idfs = {term: idf for idf, term in weighted}
+            scores = {}
+            if idfs:
+                for term, doc, tf, length in conn.execute(
+                    f"SELECT term, id, tf, length FROM postings WHERE term IN ({','.join('?' * len(idfs))})", list(idfs)
+                ):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[doc] = scores.get(doc, 0.0) + idfs[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            examples = dict(conn.execute(
+                f"SELECT id, example FROM examples WHERE id IN ({','.join('?' * len(best))})", [doc for doc, _ in best]
+            )) if best else {}
+            return [(score, json.loads(examples[doc])) for doc, score in best]
+
+    def select(self, record, k=DEFAULT_K, token_budget=DEFAULT_TOKEN_BUDGET):
+        # Most similar examples first, skipping any that would push the block over the budget
+        selected = []
+        remaining = token_budget
+        for _, example in self.search(record, k * 4):
+            cost = example_tokens(example)
+            if cost <= remaining:
+                selected.append(example)
+                remaining -= cost
+                if len(selected) == k:
+                    break
+        return selected
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_example_pool(path):
+    """Process-wide pool per path, shared by every worker."""
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ExamplePool(path)
+        return _pools[path]
+
+
+def _read_examples(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query few-shot example pools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="add labeled examples from a JSONL file")
+    add.add_argument("pool")
+    add.add_argument("examples")
+    query = commands.add_parser("query", help="show the examples selected for a question")
+    query.add_argument("pool")
+    query.add_argument("input")
+    query.add_argument("--response", default="")
+    query.add_argument("--context", default="")
+    query.add_argument("-k", type=int, default=DEFAULT_K)
+    query.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    args = parser.parse_args(argv)
+
+    pool = ExamplePool(args.pool)
+    if args.command == "add":
+        added = pool.add(_read_examples(args.examples))
+        print(f"added {added} examples ({len(pool)} in pool)", file=sys.stderr)
+        return 0
+
+    started = time.perf_counter()
+    selected = pool.select({"input": args.input, "response": args.response, "context": args.context},
+                           args.k, args.token_budget)
+    elapsed = time.perf_counter() - started
+    for example in selected:
+        print(json.dumps(example, ensure_ascii=False))
+    print(f"{len(selected)} of {len(pool)} examples in {elapsed * 1000:.1f}ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
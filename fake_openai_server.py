@@ -0,0 +1,267 @@
+"""Local stand-in for the OpenAI chat completions API, for load testing without spending quota.
+
+Serves POST /v1/chat/completions (streaming and non-streaming) with a configurable latency
+distribution, error rate and token rate, and GET /stats with request/token counters.
+
+    $ python fake_openai_server.py --port 8911 --median-latency 0.8 --error-rate 0.02
+    $ OPENAI_BASE_URL=http://127.0.0.1:8911/v1 OPENAI_API_KEY=fake streamlit run streamlit_app.py
+
+Responses are picked by the first matching rule (a regex over the last user message); the
+built-in rules return a JSON example for generate_example, a SCORE/CRITIQUE judgement for
+evaluation requests (one block per metric for fused requests) and a canned evaluation prompt
+otherwise. --responses loads extra rules from a JSON list of {"match": regex, "response":
+template}; templates may use {model}, {score}, {confidence}, {prompt_chars}, and {country} and {capital}
+(a random pair, so generated examples differ).
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CANNED_PROMPT = (
+    "### **Evaluation:**\n\n**Example Format**\n\nQUESTION:\n\nAI ASSISTANT ANSWER:\n\n—\n\nSCORE:\n\nCRITIQUE:\n\n"
+    "- **Objective:** Assess responses from any AI model according to the user's criteria.\n"
+    "- **Process:** Analyze the response carefully against the criteria.\n"
+    "- **Scoring:** Use the user's scoring rubric.\n"
+    "- **Feedback:** Provide a concise justification for the assigned score."
+)
+CANNED_EXAMPLE = json.dumps({
+    "input": "What is the capital of {country}?",
+    "response": "The capital of {country} is {capital}.",
+    "reference": "{capital} is the capital of {country}.",
+    "context": "{country} is a country. Its capital is {capital}.",
+    "score": "{score}",
+    "critique": "The response is accurate and concise.",
+})
+
+CAPITALS = [
+    ("France", "Paris"), ("Japan", "Tokyo"), ("Kenya", "Nairobi"), ("Peru", "Lima"), ("Canada", "Ottawa"),
+    ("Egypt", "Cairo"), ("Norway", "Oslo"), ("Chile", "Santiago"), ("Vietnam", "Hanoi"), ("Poland", "Warsaw"),
+]
+
+DEFAULT_RULES = [
+    {"match": r"JSON format", "response": CANNED_EXAMPLE},
+    {"match": r"CONFIDENCE: <confidence>", "response": "SCORE: {score}\nCONFIDENCE: {confidence}\nCRITIQUE: The response addresses the question adequately."},
+    {"match": r"SCORE: <score>", "response": "SCORE: {score}\nCRITIQUE: The response addresses the question adequately."},
+    {"match": r"", "response": CANNED_PROMPT},
+]
+
+
+def count_tokens(text):
+    # Close enough for load accounting: ~4 characters per token
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAIConfig:
+    def __init__(self, median_latency=0.5, latency_sigma=0.5, error_rate=0.0, rate_limit_share=0.5,
+                 tokens_per_second=200.0, rules=None, seed=None):
+        self.median_latency = median_latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share
+        self.tokens_per_second = tokens_per_second
+        self.rules = [(re.compile(rule["match"]), rule["response"]) for rule in (rules or []) + DEFAULT_RULES]
+        self.random = random.Random(seed)
+
+    def sample_latency(self):
+        # Log-normal time to first token, parameterised by its median
+        if self.median_latency <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.median_latency), self.latency_sigma)
+
+    def respond(self, request):
+        messages = request.get("messages", [])
+        last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        fused_metrics = re.findall(r"\[METRIC: (\w+)\]", last_user)
+        if fused_metrics:
+            # Fused multi-metric judge request: one SCORE/CRITIQUE block per metric
+            return "\n\n".join(f"[METRIC: {name}]\nSCORE: {self.random.randint(1, 5)}\nCRITIQUE: Adequate."
+                               for name in fused_metrics)
+        for pattern, template in self.rules:
+            if pattern.search(last_user):
+                country, capital = self.random.choice(CAPITALS)
+                return (template
+                        .replace("{country}", country)
+                        .replace("{capital}", capital)
+                        .replace("{model}", str(request.get("model", "")))
+                        .replace("{score}", str(self.random.randint(1, 5)))
+                        .replace("{confidence}", str(round(self.random.uniform(0.4, 1.0), 2)))
+                        .replace("{prompt_chars}", str(sum(len(m.get("content", "")) for m in messages))))
+        return ""
+
+
+class FakeOpenAIStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "streams": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ids = itertools.count(1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        config, stats = self.server.config, self.server.stats
+        stats.add(requests=1)
+        time.sleep(config.sample_latency())
+
+        if config.random.random() < config.error_rate:
+            stats.add(errors=1)
+            if config.random.random() < config.rate_limit_share:
+                self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                                headers={"retry-after": "1"})
+            else:
+                self._send_json(500, {"error": {"message": "Internal error (fake)", "type": "server_error"}})
+            return
+
+        content = config.respond(request)
+        model = request.get("model", "fake")
+        prompt_tokens = sum(count_tokens(m.get("content", "")) for m in request.get("messages", []))
+        completion_tokens = count_tokens(content)
+        stats.add(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        completion_id = f"chatcmpl-fake-{next(self.ids)}"
+
+        if request.get("stream"):
+            stats.add(streams=1)
+            usage = None
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+            self._stream(completion_id, model, content, usage)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _stream(self, completion_id, model, content, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data):
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        delay = 1.0 / self.server.config.tokens_per_second if self.server.config.tokens_per_second else 0.0
+        pieces = re.findall(r"\S+\s*|\s+", content)
+        for index, piece in enumerate(pieces):
+            if index and delay:
+                time.sleep(delay)
+            send_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }))
+        send_event(json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }))
+        if usage is not None:
+            send_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0, config=None):
+    """Start the fake server on a background thread; returns (server, base_url). Call server.shutdown() to stop it."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.config = config or FakeOpenAIConfig()
+    server.stats = FakeOpenAIStats()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--median-latency", type=float, default=0.5, help="median seconds before the first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--rate-limit-share", type=float, default=0.5, help="fraction of failures returned as 429")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="streaming speed")
+    parser.add_argument("--responses", help="JSON file with extra response rules")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    rules = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            rules = json.load(f)
+    config = FakeOpenAIConfig(args.median_latency, args.latency_sigma, args.error_rate, args.rate_limit_share,
+                              args.tokens_per_second, rules, args.seed)
+    server, base_url = start_server(args.host, args.port, config)
+    print(f"Fake OpenAI server listening on {base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import contextvars
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+FINISHED = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_RETENTION_SECONDS = 60 * 60
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, kind, deadline=None):
+        self.id = job_id
+        self.kind = kind
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        # Streamed jobs expose what has arrived so far, so a rerun can pick up mid-generation
+        self.partial = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.deadline = self.created + deadline if deadline else None
+        self.future = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def text(self):
+        return "".join(self.partial)
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED
+
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        # Long-running job bodies call this between steps to stop early
+        if self._cancel.is_set() or (self.deadline is not None and time.time() > self.deadline):
+            raise JobCancelled(self.id)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self.is_finished:
+                return False
+            self.status = RUNNING
+            self.started = time.time()
+            return True
+
+    def _finish(self, status, result=None, error=None):
+        # First finisher wins: a result that arrives after a cancel or timeout is dropped
+        with self._lock:
+            if self.is_finished:
+                return False
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+        self._done.set()
+        return True
+
+
+class JobExecutor:
+    """Process-level worker pool plus job table, so generations outlive the Streamlit rerun that started them."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.retention_seconds = retention_seconds
+
+    def _new_job(self, kind, deadline):
+        job = Job(f"{kind}-{next(self._counter)}-{uuid.uuid4().hex[:8]}", kind, deadline)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.is_finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job, body):
+        if not job._start():
+            return
+        try:
+            result = body(job)
+        except JobCancelled:
+            job._finish(TIMED_OUT if self._expired(job) else CANCELLED)
+        except Exception as e:
+            job._finish(FAILED, error=e)
+        else:
+            job._finish(DONE, result=result)
+
+    def _submit(self, job, body):
+        # Workers inherit the submitting context (e.g. request priority)
+        context = contextvars.copy_context()
+        job.future = self._pool.submit(context.run, self._run, job, body)
+        return job.id
+
+    def submit(self, fn, *args, kind="job", deadline=None, **kwargs):
+        """Run fn(*args, **kwargs) in the background and return the job id; deadline is in seconds."""
+        job = self._new_job(kind, deadline)
+        return self._submit(job, lambda job: fn(*args, **kwargs))
+
+    def submit_stream(self, factory, kind="stream", deadline=None):
+        """Consume the iterator returned by factory() in the background; job.partial fills as chunks arrive."""
+        job = self._new_job(kind, deadline)
+
+        def body(job):
+            chunks = factory()
+            try:
+                for chunk in chunks:
+                    job.check_cancelled()
+                    job.partial.append(chunk)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            return job.text
+
+        return self._submit(job, body)
+
+    def _expired(self, job):
+        return job.deadline is not None and time.time() > job.deadline
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and not job.is_finished and self._expired(job):
+            self._stop(job, TIMED_OUT)
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.is_finished:
+            self._stop(job, CANCELLED)
+        return job
+
+    def _stop(self, job, status):
+        job._cancel.set()
+        if job.future is not None:
+            job.future.cancel()
+        # A blocking API call can't be interrupted; its result is simply discarded when it lands
+        job._finish(status)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {status: 0 for status in (PENDING, RUNNING) + FINISHED}
+        for job in jobs:
+            counts[job.status] += 1
+        return counts
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = JobExecutor()
+        return _default_executor
@@ -0,0 +1,77 @@
+"""Local scorers for metrics simple enough to judge without a model.
+
+A heuristic returns (score, critique, confidence) for a record, or None when it can't judge
+it. Cascaded metrics (see evaluation.py) try their heuristic first and escalate to a model
+when it declines or its confidence is low.
+"""
+import re
+
+
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+LIST_ITEM = re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s+\S")
+MEMO_HEADER = re.compile(r"^\s*\**\s*(MEMORANDUM|TO|FROM|DATE|RE|SUBJECT)\s*\**\s*:?", re.IGNORECASE)
+# Memo headers that mark a legal memorandum when at least MEMO_MIN_HEADERS of them appear
+MEMO_MIN_HEADERS = 3
+
+
+def _blocks(text):
+    # Paragraphs separated by blank lines, as lists of lines
+    blocks, current = [], []
+    for line in text.splitlines():
+        if line.strip():
+            current.append(line)
+        elif current:
+            blocks.append(current)
+            current = []
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def score_formattings(record):
+    """Count the distinct formattings in the response, per the "Formattings" prompt template.
+
+    Text right after a table is part of the table, and lists inside a memorandum are part of
+    the memorandum. Confidence drops when those rules decide the count, since "refers to the
+    table's content" is a judgement call.
+    """
+    response = str(record.get("response", ""))
+    if not response.strip():
+        return 0, "[]", 1.0
+
+    memo_headers = sum(bool(MEMO_HEADER.match(line)) for line in response.splitlines())
+    is_memo = memo_headers >= MEMO_MIN_HEADERS
+    found = []
+    confidence = 1.0
+    if is_memo:
+        found.append("legal memorandum")
+    elif memo_headers:
+        confidence = 0.5
+
+    after_table = False
+    for block in _blocks(response):
+        if is_memo:
+            # Everything after the headers belongs to the memo, except a table
+            kind = "table" if any(TABLE_SEPARATOR.match(line) for line in block) else None
+        elif any(TABLE_SEPARATOR.match(line) for line in block) and sum(bool(TABLE_ROW.match(line)) for line in block) >= 2:
+            kind = "table"
+        elif all(LIST_ITEM.match(line) or line.startswith((" ", "\t")) for line in block) and LIST_ITEM.match(block[0]):
+            kind = "list"
+        elif after_table:
+            # Text following a table counts as part of it, if it refers to the table
+            kind = None
+            confidence = min(confidence, 0.6)
+        else:
+            kind = "unformatted text"
+        after_table = kind == "table" or (after_table and kind is None)
+        if kind and kind not in found:
+            found.append(kind)
+
+    critique = "[" + ", ".join(f"'{kind}'" for kind in found) + "]"
+    return len(found), critique, confidence
+
+
+HEURISTICS = {
+    "formattings": score_formattings,
+}
@@ -0,0 +1,250 @@
+"""Compiled metric bundles: deployed metrics in one file that evaluator services can open fast.
+
+A bundle is [magic][schema version, index length][JSON index][data]. The index maps each
+metric name to its content hash and to byte ranges in the data section holding its metadata
+(criteria, rubric, input variables, examples, judge settings), its system prompt and its
+pre-rendered judge template. The template is the user message of evaluation.render_record
+with the record fields cut out; their positions are stored as placeholder offsets, so
+rendering a record is a join of slices rather than a re-format. The file is memory-mapped and
+only the index is parsed on open; a metric's ranges are decoded the first time it is used.
+evaluation.load_metrics returns a bundle as a BundleMetrics mapping, which decodes each metric
+on first lookup; the metrics render through the bundle, so it stays open until
+evaluation.close_metrics.
+
+    $ python metric_bundle.py build .data/metrics.sqlite3 metrics.bundle
+    $ python metric_bundle.py show metrics.bundle
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import struct
+import sys
+import threading
+import time
+from collections.abc import Mapping
+
+from evaluation import DEFAULT_MODEL, assemble_judge_messages, close_metrics, load_metrics, render_record
+
+
+MAGIC = b"METRBND1"
+HEADER = struct.Struct(">HI")
+SCHEMA_VERSION = 1
+DEFINITION_FIELDS = ("criteria", "scoring_rubric", "input_variables", "prompt", "examples")
+# How evaluation.py judges the metric (token budget, example pool, chunking, cascade), kept with its metadata
+JUDGE_FIELDS = ("token_budget", "example_pool", "pool_k", "pool_token_budget", "chunk_tokens", "chunk_overlap",
+                "chunk_reduce", "cascade", "escalate_below", "heuristic")
+# Stand-in values used to locate the record fields in a rendered template
+PLACEHOLDER = "\x00{}\x00"
+
+
+def metric_hash(metric):
+    payload = json.dumps({field: metric.get(field) for field in DEFINITION_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def compile_template(metric):
+    # Returns (template text without placeholders, [(offset, field), ...])
+    fields = {field: PLACEHOLDER.format(field) for field in metric["input_variables"]}
+    rendered = render_record(metric, fields)
+    template, slots, position = [], [], 0
+    while True:
+        start = rendered.find("\x00", position)
+        if start < 0:
+            template.append(rendered[position:])
+            break
+        end = rendered.index("\x00", start + 1)
+        template.append(rendered[position:start])
+        slots.append((sum(len(part) for part in template), rendered[start + 1:end]))
+        position = end + 1
+    return "".join(template), slots
+
+
+def write_bundle(metrics, f):
+    """Write metrics ({name: metric} or a list of metrics with "name") as a bundle to a binary file object."""
+    if not isinstance(metrics, Mapping):
+        metrics = {metric["name"]: metric for metric in metrics}
+
+    data = bytearray()
+    entries = {}
+
+    def append(blob):
+        data.extend(blob)
+        return [len(data) - len(blob), len(blob)]
+
+    for name in sorted(metrics):
+        metric = metrics[name]
+        template, slots = compile_template(metric)
+        meta = {field: metric.get(field) for field in DEFINITION_FIELDS if field != "prompt"}
+        for field in ("version", "tags") + JUDGE_FIELDS:
+            if metric.get(field) is not None:
+                meta[field] = metric[field]
+        entries[name] = {
+            "hash": metric_hash(metric),
+            "meta": append(json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+            "system": append(metric["prompt"].encode("utf-8")),
+            "template": append(template.encode("utf-8")),
+            "slots": slots,
+        }
+
+    bundle_hash = hashlib.sha256("".join(entry["hash"] for entry in entries.values()).encode("ascii")).hexdigest()
+    index = json.dumps({"hash": bundle_hash, "created_at": time.time(), "metrics": entries}).encode("utf-8")
+    f.write(MAGIC)
+    f.write(HEADER.pack(SCHEMA_VERSION, len(index)))
+    f.write(index)
+    f.write(data)
+    return bundle_hash
+
+
+def build_bundle(metrics, path):
+    with open(path, "wb") as f:
+        return write_bundle(metrics, f)
+
+
+class MetricBundle:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path!r} is not a metric bundle")
+        schema_version, index_length = HEADER.unpack_from(self._map, len(MAGIC))
+        if schema_version != SCHEMA_VERSION:
+            self.close()
+            raise ValueError(f"{path!r} has bundle schema version {schema_version}, expected {SCHEMA_VERSION}")
+        start = len(MAGIC) + HEADER.size
+        index = json.loads(self._map[start:start + index_length])
+        self._data_start = start + index_length
+        self.hash = index["hash"]
+        self.created_at = index["created_at"]
+        self._entries = index["metrics"]
+        self._compiled = {}
+        self._judged = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def names(self):
+        return list(self._entries)
+
+    def metric_hash(self, name):
+        return self._entries[name]["hash"]
+
+    def _slice(self, byte_range):
+        offset, length = byte_range
+        return self._map[self._data_start + offset:self._data_start + offset + length].decode("utf-8")
+
+    def _compile(self, name):
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            entry = self._entries[name]
+            template = self._slice(entry["template"])
+            segments, position = [], 0
+            for offset, field in entry["slots"]:
+                segments.append(template[position:offset])
+                position = offset
+            segments.append(template[position:])
+            compiled = (self._slice(entry["system"]), segments, [field for _, field in entry["slots"]])
+            with self._lock:
+                self._compiled[name] = compiled
+        return compiled
+
+    def render(self, name, record):
+        """The judge user message for record, identical to evaluation.render_record."""
+        _, segments, fields = self._compile(name)
+        parts = [segments[0]]
+        for field, segment in zip(fields, segments[1:]):
+            parts.append(str(record.get(field, "")))
+            parts.append(segment)
+        return "".join(parts)
+
+    def build_messages(self, name, record, model=DEFAULT_MODEL):
+        """Judge messages for record as evaluation.py builds them: rendered from the bundle, with
+        the metric's pool examples and fitted to its token budget."""
+        metric = self._judged.get(name)
+        if metric is None:
+            metric = {**self.metric(name), "bundle": self}
+            with self._lock:
+                self._judged[name] = metric
+        return assemble_judge_messages(metric, record, model)[0]
+
+    def metric(self, name):
+        """Full metric definition, in the format evaluation.py works with."""
+        entry = self._entries[name]
+        return {"name": name, **json.loads(self._slice(entry["meta"])), "prompt": self._compile(name)[0]}
+
+    def metrics(self):
+        return {name: self.metric(name) for name in self._entries}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class BundleMetrics(Mapping):
+    """{name: metric} view of a bundle; a metric is only decoded when it is looked up."""
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self._decoded = {}
+
+    def __getitem__(self, name):
+        metric = self._decoded.get(name)
+        if metric is None:
+            metric = self.bundle.metric(name)
+            # Judge messages are rendered from the bundle
+            metric["bundle"] = self.bundle
+            self._decoded[name] = metric
+        return metric
+
+    def __contains__(self, name):
+        return name in self.bundle
+
+    def __iter__(self):
+        return iter(self.bundle.names())
+
+    def __len__(self):
+        return len(self.bundle)
+
+    def close(self):
+        self.bundle.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and inspect compiled metric bundles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile deployed metrics (JSONL or metric store) into a bundle")
+    build.add_argument("metrics")
+    build.add_argument("bundle")
+    show = commands.add_parser("show", help="list the metrics in a bundle")
+    show.add_argument("bundle")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        metrics = load_metrics(args.metrics)
+        try:
+            bundle_hash = build_bundle(metrics, args.bundle)
+        finally:
+            close_metrics(metrics)
+        print(f"{len(metrics)} metrics -> {args.bundle} ({bundle_hash[:12]})", file=sys.stderr)
+        return 0
+
+    started = time.perf_counter()
+    bundle = MetricBundle(args.bundle)
+    elapsed = time.perf_counter() - started
+    print(f"schema {SCHEMA_VERSION}, {len(bundle)} metrics, hash {bundle.hash[:12]}, opened in {elapsed * 1000:.1f}ms")
+    for name in bundle.names():
+        print(f"  {name}  {bundle.metric_hash(name)[:12]}")
+    bundle.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
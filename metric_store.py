@@ -0,0 +1,183 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_STORE_PATH = os.environ.get("METRIC_STORE_PATH", os.path.join(".data", "metrics.sqlite3"))
+# Fields that make up a metric definition; anything else (version, tags, ...) is store metadata
+DEFINITION_FIELDS = ("criteria", "scoring_rubric", "input_variables", "prompt", "examples")
+
+
+def _definition(metric):
+    return {field: metric.get(field) for field in DEFINITION_FIELDS}
+
+
+def parse_tags(text):
+    return sorted({tag.strip().lower() for tag in (text or "").split(",") if tag.strip()})
+
+
+class MetricStore:
+    """Versioned metric library in SQLite, shared by every session and the batch tools.
+
+    Every deploy that changes a metric adds a version; the latest versions are kept in an
+    in-process cache that is only reloaded when another writer bumps the store revision.
+    Readers that have just checked revision() can pass refresh=False to all() and tags() to
+    use that cache without another query.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._revision = None
+        self._latest = {}
+        self._reader = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS metric_versions (
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    definition TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (name, version)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS metrics (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    tags TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS store_revision (id INTEGER PRIMARY KEY CHECK (id = 0), revision INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO store_revision (id, revision) VALUES (0, 0)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _bump(self, conn):
+        conn.execute("UPDATE store_revision SET revision = revision + 1 WHERE id = 0")
+
+    def _refresh(self):
+        # One single-row read per call on a connection kept open for it; the latest versions are
+        # only re-read after a write. Called with the lock held.
+        if self._reader is None:
+            self._reader = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn = self._reader
+        revision = conn.execute("SELECT revision FROM store_revision WHERE id = 0").fetchone()[0]
+        if revision == self._revision:
+            return
+        rows = conn.execute(
+            "SELECT m.name, m.version, m.tags, m.updated_at, v.definition FROM metrics m "
+            "JOIN metric_versions v ON v.name = m.name AND v.version = m.version"
+        ).fetchall()
+        self._latest = {
+            name: {"name": name, **json.loads(definition), "version": version, "tags": json.loads(tags), "updated_at": updated_at}
+            for name, version, tags, updated_at, definition in rows
+        }
+        self._revision = revision
+
+    def revision(self):
+        """Changes whenever any process writes to the store; cheap enough to poll on every rerun."""
+        with self._lock:
+            self._refresh()
+            return self._revision
+
+    def save(self, name, metric, tags=None):
+        """Store metric as the latest version of name; an unchanged definition isn't written again."""
+        definition = _definition(metric)
+        tags = sorted(set(tags)) if tags is not None else None
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            # Takes the write lock before reading, so another process can't save the same version in between
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT m.version, m.tags, v.definition FROM metrics m "
+                "JOIN metric_versions v ON v.name = m.name AND v.version = m.version WHERE m.name = ?", (name,)
+            ).fetchone()
+            if row:
+                version = row[0]
+            else:
+                # A deleted metric that is deployed again continues its version history
+                version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM metric_versions WHERE name = ?", (name,)).fetchone()[0]
+            old_tags = json.loads(row[1]) if row else []
+            tags = old_tags if tags is None else tags
+            changed = row is None or json.loads(row[2]) != definition
+            if not changed and tags == old_tags:
+                return version
+            if changed:
+                version += 1
+                conn.execute("INSERT INTO metric_versions (name, version, definition, created_at) VALUES (?, ?, ?, ?)",
+                             (name, version, json.dumps(definition, ensure_ascii=False), now))
+            conn.execute("INSERT OR REPLACE INTO metrics (name, version, tags, updated_at) VALUES (?, ?, ?, ?)",
+                         (name, version, json.dumps(tags), now))
+            self._bump(conn)
+        return version
+
+    def delete(self, name):
+        # Removes the metric from the library; its versions stay for history
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM metrics WHERE name = ?", (name,))
+            self._bump(conn)
+
+    def get(self, name, version=None):
+        if version is None:
+            with self._lock:
+                self._refresh()
+                metric = self._latest.get(name)
+            # Copies, so callers can edit a metric (e.g. its examples) without touching the cache
+            return copy.deepcopy(metric)
+        with self._connect() as conn:
+            row = conn.execute("SELECT definition, created_at FROM metric_versions WHERE name = ? AND version = ?",
+                               (name, version)).fetchone()
+        if row is None:
+            return None
+        return {"name": name, **json.loads(row[0]), "version": version, "updated_at": row[1]}
+
+    def all(self, refresh=True):
+        """Latest version of every metric, by name."""
+        with self._lock:
+            if refresh:
+                self._refresh()
+            return copy.deepcopy(self._latest)
+
+    def names(self, tag=None):
+        with self._lock:
+            self._refresh()
+            return sorted(name for name, metric in self._latest.items() if tag is None or tag in metric["tags"])
+
+    def tags(self, refresh=True):
+        with self._lock:
+            if refresh:
+                self._refresh()
+            return sorted({tag for metric in self._latest.values() for tag in metric["tags"]})
+
+    def versions(self, name):
+        with self._connect() as conn:
+            return [{"version": version, "created_at": created_at} for version, created_at in
+                    conn.execute("SELECT version, created_at FROM metric_versions WHERE name = ? ORDER BY version", (name,))]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def set_store(store):
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
+
+
+def get_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = MetricStore()
+        return _default_store
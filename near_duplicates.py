@@ -0,0 +1,196 @@
+"""Near-duplicate detection for labeled examples, with MinHash signatures and an LSH index.
+
+An example's content (input, response, reference, context) is reduced to its set of word
+3-grams and sketched with one-permutation MinHash: each shingle hash is assigned to one of
+NUM_PERM bins and each bin keeps its minimum, so a signature costs a single pass over the
+shingles. Two signatures agree in a bin with probability equal to the Jaccard similarity
+of the shingle sets. Signatures are split into BANDS bands of ROWS bins; examples sharing
+any band are candidates, and candidates are confirmed against the threshold with the full
+signature. Lookups touch BANDS buckets and a handful of candidates, well under a
+millisecond regardless of how many examples are indexed.
+
+    $ python near_duplicates.py labeled.jsonl --threshold 0.5
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import zlib
+
+from example_pool import tokenize
+
+
+CONTENT_FIELDS = ("input", "response", "reference", "context")
+SHINGLE_SIZE = 3
+# With 3 rows per band, pairs at Jaccard 0.5 share a band with probability > 0.99 and pairs at 0.1 with ~0.04
+BANDS = 42
+ROWS = 3
+NUM_PERM = BANDS * ROWS
+DEFAULT_THRESHOLD = 0.5
+
+_EMPTY = 1 << 32
+
+
+def shingles(text):
+    tokens = tokenize(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def example_text(example):
+    if isinstance(example, str):
+        return example
+    return "\n".join(str(example.get(field, "")) for field in CONTENT_FIELDS)
+
+
+def signature(text):
+    """MinHash signature of text as a tuple of NUM_PERM ints, or None if it has no words."""
+    bins = [_EMPTY] * NUM_PERM
+    for shingle in shingles(text):
+        h = zlib.crc32(shingle.encode("utf-8"))
+        i = h % NUM_PERM
+        if h < bins[i]:
+            bins[i] = h
+    if all(value == _EMPTY for value in bins):
+        return None
+    # Densify: an empty bin borrows the next filled bin's value, offset by the distance, so
+    # short texts still compare on every bin
+    for i in range(NUM_PERM):
+        if bins[i] == _EMPTY:
+            distance = 1
+            while bins[(i + distance) % NUM_PERM] >= _EMPTY:
+                distance += 1
+            bins[i] = bins[(i + distance) % NUM_PERM] + distance * _EMPTY
+    return tuple(bins)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._signatures = []
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _bands(self, sig):
+        return [(band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def _find(self, sig):
+        best, best_similarity = None, 0.0
+        seen = set()
+        for key in self._bands(sig):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                score = similarity(sig, self._signatures[candidate])
+                if score > best_similarity:
+                    best, best_similarity = candidate, score
+        if best is not None and best_similarity >= self.threshold:
+            return best, best_similarity
+        return None
+
+    def _insert(self, sig):
+        position = len(self._signatures)
+        self._signatures.append(sig)
+        for key in self._bands(sig):
+            self._buckets.setdefault(key, []).append(position)
+        return position
+
+    def add(self, example):
+        """Index an example (dict or text); returns its position, or None if it has no words."""
+        sig = signature(example_text(example))
+        if sig is None:
+            return None
+        with self._lock:
+            return self._insert(sig)
+
+    def find(self, example):
+        """(position, similarity) of the most similar indexed example at or above the threshold, else None."""
+        sig = signature(example_text(example))
+        if sig is None:
+            return None
+        with self._lock:
+            return self._find(sig)
+
+    def add_unique(self, example):
+        """Index the example unless it near-duplicates one already indexed.
+
+        Returns (True, position) when added and (False, (position, similarity)) of the
+        duplicated example when rejected. The check and the insert are atomic, so
+        concurrent generators can't both add the same example.
+        """
+        sig = signature(example_text(example))
+        if sig is None:
+            return True, None
+        with self._lock:
+            match = self._find(sig)
+            if match is not None:
+                return False, match
+            return True, self._insert(sig)
+
+
+def build_index(examples, threshold=DEFAULT_THRESHOLD):
+    index = NearDuplicateIndex(threshold)
+    for example in examples:
+        index.add(example)
+    return index
+
+
+_pool_indexes = {}
+_pool_indexes_lock = threading.Lock()
+
+
+def pool_index(pool, threshold=DEFAULT_THRESHOLD):
+    """Index of an example pool, built on first use and extended with examples added since."""
+    with _pool_indexes_lock:
+        key = (pool.path, threshold)
+        entry = _pool_indexes.get(key)
+        if entry is None:
+            entry = _pool_indexes[key] = [NearDuplicateIndex(threshold), 0]
+        index, indexed = entry
+        new_examples = pool.examples(indexed)
+        for example in new_examples:
+            index.add(example)
+        entry[1] = indexed + len(new_examples)
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List near-duplicate examples in a JSONL file.")
+    parser.add_argument("examples", help="JSONL file of labeled examples")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    with open(args.examples, encoding="utf-8") as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+
+    index = NearDuplicateIndex(args.threshold)
+    positions = {}
+    duplicates = 0
+    started = time.perf_counter()
+    for line_number, example in enumerate(examples, 1):
+        added, result = index.add_unique(example)
+        if added:
+            positions[result] = line_number
+        else:
+            duplicates += 1
+            position, score = result
+            print(f"line {line_number} near-duplicates line {positions[position]} (similarity {score:.2f})")
+    elapsed = time.perf_counter() - started
+    print(f"{duplicates} of {len(examples)} examples are near-duplicates "
+          f"({elapsed / max(1, len(examples)) * 1e6:.0f}us per example)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Opt-in timing of app reruns and API calls.
+
+A Trace collects spans: the sections of one rerun (closed by calling section() with the next
+section's name) plus every completion (and the API request behind it) made while it is
+current, including those made by background jobs started from it. Traces export to the
+Chrome trace event format, which chrome://tracing and https://ui.perfetto.dev open directly.
+"""
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+
+PROFILE_BY_DEFAULT = os.environ.get("PROFILE_RERUNS", "") not in ("", "0", "false")
+_EPOCH = time.perf_counter()
+_trace_ids = itertools.count(1)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    __slots__ = ("name", "category", "start", "end", "thread", "args")
+
+    def __init__(self, name, category, start, end, thread, args):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = end
+        self.thread = thread
+        self.args = args
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Trace:
+    def __init__(self, name):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.interrupted = False
+        self.spans = []
+        self._section = None
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def section(self, name):
+        # Ends the current section and starts the next one
+        now = time.perf_counter()
+        if self._section is not None:
+            section_name, started = self._section
+            self.add(Span(section_name, "section", started, now, threading.current_thread().name, {}))
+        self._section = (name, now) if name else None
+
+    def finish(self, interrupted=False):
+        if self.end is not None:
+            return
+        self.section(None)
+        self.end = time.perf_counter()
+        self.interrupted = interrupted
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def sections(self):
+        return [span for span in self.spans if span.category == "section"]
+
+    def completions(self):
+        # One per create_completion/stream_completion call, with its cache status and tokens
+        return [span for span in self.spans if span.category == "completion"]
+
+
+def start_trace(name):
+    """Start a trace and make it current for this context (and the jobs it starts)."""
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name, category="app", **args):
+    """Time the block as part of the current trace; the yielded dict becomes the span's args."""
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield args
+    finally:
+        if trace is not None:
+            trace.add(Span(name, category, started, time.perf_counter(), threading.current_thread().name, args))
+
+
+def record_span(name, category, started, **args):
+    # For work that can't sit inside a with block, e.g. a generator consumed elsewhere
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(Span(name, category, started, time.perf_counter(), threading.current_thread().name, args))
+
+
+def chrome_trace(traces):
+    """Traces as a Chrome trace event JSON document (timestamps in microseconds)."""
+    events = []
+    threads = {}
+    for trace in traces:
+        end = trace.end or time.perf_counter()
+        events.append({"name": trace.name, "cat": "rerun", "ph": "X", "pid": 1, "tid": 0,
+                       "ts": (trace.start - _EPOCH) * 1e6, "dur": (end - trace.start) * 1e6,
+                       "args": {"trace": trace.id, "interrupted": trace.interrupted}})
+        for s in list(trace.spans):
+            tid = threads.setdefault(s.thread, len(threads) + 1)
+            events.append({"name": s.name, "cat": s.category, "ph": "X", "pid": 1, "tid": tid,
+                           "ts": (s.start - _EPOCH) * 1e6, "dur": s.duration * 1e6,
+                           "args": dict(s.args, trace=trace.id)})
+    events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "reruns"}})
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}})
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
@@ -0,0 +1,129 @@
+"""Token counting and budget fitting for judge prompts.
+
+Counts use tiktoken when it is installed and fall back to ~4 characters per token otherwise.
+Oversized fields are cut in the middle, keeping the head and tail, with a visible marker
+so the judge (and whoever reads the critique) knows text was removed.
+"""
+import functools
+import math
+
+try:
+    import tiktoken
+except ImportError:  # Optional: budgets are approximate without it
+    tiktoken = None
+
+
+# Context windows of the models the app is used with; unknown models get the smallest
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# Room left for the judge's answer
+COMPLETION_RESERVE = 512
+# Chat format overhead: per message, plus the priming of the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# Never cut a field below this, so the judge still sees what it is about
+MIN_FIELD_TOKENS = 64
+TRUNCATION_MARKER = "\n[... {} tokens truncated ...]\n"
+
+
+class PromptBudgetExceeded(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model=None):
+    text = text or ""
+    if tiktoken is None:
+        return math.ceil(len(text) / 4)
+    return len(_encoding(model or "gpt-3.5-turbo").encode(text, disallowed_special=()))
+
+
+def context_window(model):
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model and model.startswith(name):
+            return CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def default_budget(model):
+    return context_window(model) - COMPLETION_RESERVE
+
+
+def truncate_tokens(text, max_tokens, model=None):
+    """Cut text to at most max_tokens (marker included), keeping two thirds head and one third tail."""
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens:
+        return text
+    # A couple of spare tokens: re-encoding across the cut can merge differently
+    marker_tokens = count_tokens(TRUNCATION_MARKER.format(tokens), model) + (2 if tiktoken else 0)
+    keep = max(0, max_tokens - marker_tokens)
+    head, tail = keep * 2 // 3, keep - keep * 2 // 3
+    marker = TRUNCATION_MARKER.format(tokens - keep)
+
+    if tiktoken is None:
+        return text[:head * 4] + marker + (text[len(text) - tail * 4:] if tail else "")
+    encoding = _encoding(model or "gpt-3.5-turbo")
+    ids = encoding.encode(text, disallowed_special=())
+    return encoding.decode(ids[:head]) + marker + (encoding.decode(ids[-tail:]) if tail else "")
+
+
+def split_tokens(text, chunk_tokens, overlap=0, model=None):
+    """Split text into chunks of at most chunk_tokens, each starting overlap tokens before the previous one ended."""
+    step = max(1, chunk_tokens - overlap)
+    if tiktoken is None:
+        size, stride = chunk_tokens * 4, step * 4
+        if len(text) <= size:
+            return [text]
+        return [text[start:start + size] for start in range(0, len(text) - overlap * 4, stride)]
+    encoding = _encoding(model or "gpt-3.5-turbo")
+    ids = encoding.encode(text, disallowed_special=())
+    if len(ids) <= chunk_tokens:
+        return [text]
+    return [encoding.decode(ids[start:start + chunk_tokens]) for start in range(0, len(ids) - overlap, step)]
+
+
+def fit_fields(fields, available, truncatable, model=None):
+    """Shrink the truncatable fields (in that order) until all fields fit in available tokens.
+
+    Returns (fields, truncated field names); raises PromptBudgetExceeded if even the
+    truncated fields don't fit.
+    """
+    counts = {name: count_tokens(value, model) for name, value in fields.items()}
+    overflow = sum(counts.values()) - available
+    fields = dict(fields)
+    truncated = []
+    for name in truncatable:
+        if overflow <= 0:
+            break
+        if name not in fields:
+            continue
+        cut = min(overflow, counts[name] - MIN_FIELD_TOKENS)
+        if cut <= 0:
+            continue
+        fields[name] = truncate_tokens(fields[name], counts[name] - cut, model)
+        overflow -= counts[name] - count_tokens(fields[name], model)
+        truncated.append(name)
+    if overflow > 0:
+        raise PromptBudgetExceeded(f"Prompt is {overflow} tokens over budget after truncating {truncated or 'nothing'}")
+    return fields, truncated
+
+
+def token_breakdown(parts, model=None, messages=2):
+    """Token counts per named part of a prompt, plus the chat format overhead and the total."""
+    breakdown = {name: count_tokens(text, model) for name, text in parts.items()}
+    breakdown["overhead"] = messages * MESSAGE_OVERHEAD + REPLY_OVERHEAD
+    breakdown["total"] = sum(breakdown.values())
+    return breakdown
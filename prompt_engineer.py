@@ -0,0 +1,613 @@
+import contextvars
+import json
+import os
+import re
+import textwrap
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from openai import OpenAI
+
+from cassette import get_cassette
+from llm_cache import cache_key, get_cache
+from near_duplicates import DEFAULT_THRESHOLD, NearDuplicateIndex, pool_index
+from prompt_budget import truncate_tokens
+from prompt_sections import changed_sections, join_sections, prompt_inputs, render_examples_section, replace_sections, split_sections
+from profiler import record_span, span
+from rate_limiter import call_with_retries, estimate_tokens, get_limiter
+from single_flight import get_single_flight
+from telemetry import current_operation, get_registry, operation, record_completion, track_stream
+
+
+# Used for prompt and example generation and, unless a metric has its own cascade, for judging
+DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+SCORING_RUBRIC_OPTIONS = ["Likert: 1 - 5", "Binary: 0 or 1", "Float: 0 - 1"]
+INPUT_VARIABLE_OPTIONS = ["input", "response", "reference", "context"]
+# Requests per example slot before giving up on getting one that isn't a near-duplicate
+MAX_EXAMPLE_ATTEMPTS = 3
+# Cap on the examples listed for the model to avoid; the near-duplicate index catches the rest
+MAX_AVOID_TOKENS = 1500
+
+_openai_client = None
+
+
+def set_client(client):
+    # The Streamlit app injects a client built from st.secrets; headless callers fall back to OPENAI_API_KEY
+    global _openai_client
+    _openai_client = client
+
+
+def get_client():
+    global _openai_client
+    if _openai_client is None:
+        # Retries are handled by rate_limiter.call_with_retries, not by the SDK
+        _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    return _openai_client
+
+
+def _chat_completion(messages, model, **kwargs):
+    # Every API call goes through the shared rate limiter and retry scheduler
+    limiter = get_limiter()
+    reserved_tokens = estimate_tokens(messages)
+    with span("openai.chat.completions", "openai", model=model, stream=bool(kwargs.get("stream"))) as info:
+        completion = call_with_retries(
+            lambda: get_client().chat.completions.create(model=model, messages=messages, **kwargs),
+            limiter,
+            reserved_tokens
+        )
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            limiter.adjust_tokens(usage.total_tokens - reserved_tokens)
+            info.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    return completion
+
+
+def create_completion(messages, model=DEFAULT_MODEL, bypass_cache=False):
+    # An active cassette is consulted before anything else so replays are deterministic
+    with span("completion", "completion", model=model) as info:
+        try:
+            key = cache_key(model, messages)
+            cassette = get_cassette()
+            if cassette is not None:
+                content = cassette.replay(key)
+                if content is not None:
+                    info["cache"] = "cassette"
+                    return content
+                # Recording captures what the API answers now, not an older cached sample
+                bypass_cache = bypass_cache or cassette.mode == "record"
+
+            content = _cached_completion(messages, model, key, bypass_cache, info)
+            if cassette is not None:
+                cassette.record(key, model, content)
+            return content
+        finally:
+            record_completion(model, info)
+
+
+def _cached_completion(messages, model, key, bypass_cache, info):
+    # Identical model + system prompt + user prompt always hit the on-disk cache unless bypassed.
+    # A bypassed call still writes its fresh sample back so later identical requests reuse it.
+    cache = get_cache()
+    if not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            info["cache"] = "hit"
+            return cached
+
+    # Overwritten by fetch() when this caller is the one making the API call
+    info["cache"] = "shared"
+
+    def fetch():
+        info["cache"] = "bypass" if bypass_cache else "miss"
+        completion = _chat_completion(messages, model)
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            info.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+        if not completion.choices:
+            return None
+        content = completion.choices[0].message.content
+        if content:
+            cache.set(key, model, content)
+        return content
+
+    # Concurrent identical requests (double clicks, several sessions) share one API call
+    return get_single_flight().do(key, fetch)
+
+
+def stream_completion(messages, model=DEFAULT_MODEL, bypass_cache=False, operation_name=None):
+    # Yields content deltas as they arrive; a cassette or cache hit is yielded as a single chunk.
+    # The full text is only joined (and cached/recorded) once the stream is exhausted.
+    # The stream may be consumed from another thread, so callers name the operation it belongs to.
+    started = time.perf_counter()
+    info = {"model": model, "stream": True, "operation": operation_name or current_operation()}
+    key = cache_key(model, messages)
+    cassette = get_cassette()
+    try:
+        if cassette is not None:
+            content = cassette.replay(key)
+            if content is not None:
+                info["cache"] = "cassette"
+                yield content
+                return
+            bypass_cache = bypass_cache or cassette.mode == "record"
+
+        parts = []
+        for delta in _cached_stream(messages, model, key, bypass_cache, info):
+            if not parts:
+                info["first_token"] = time.perf_counter() - started
+            parts.append(delta)
+            yield delta
+        if cassette is not None:
+            cassette.record(key, model, "".join(parts) or None)
+    finally:
+        record_span("completion", "completion", started, **info)
+        record_completion(model, info)
+
+
+def _cached_stream(messages, model, key, bypass_cache, info):
+    cache = get_cache()
+    if not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            info["cache"] = "hit"
+            yield cached
+            return
+
+    info["cache"] = "shared"
+
+    def deltas():
+        info["cache"] = "bypass" if bypass_cache else "miss"
+        # include_usage adds a final chunk with the token counts and no choices
+        stream = _chat_completion(messages, model, stream=True, stream_options={"include_usage": True})
+
+        parts = []
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                info.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        content = "".join(parts)
+        if content:
+            cache.set(key, model, content)
+
+    # Identical in-flight streams are fanned out to every subscriber from one API call
+    yield from get_single_flight().stream(key, deltas)
+
+
+def format_generated_prompt(content):
+    if not content:
+        return None
+    return textwrap.fill(content, width=80)
+
+
+def select_system_prompt(input_variables):
+    if set(input_variables) == {'input', 'response', 'reference'}:
+        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
+                '### **Precision and Conciseness Evaluation:**
+                **Example Format**
+
+                  QUESTION:
+
+                  REFERENCE RESPONSE:
+
+                  AI ASSISTANT ANSWER:
+
+                  —
+
+                  SCORE:
+
+                  CRITIQUE:
+
+                - **Objective: Assess responses from any AI model on a scale from 1 (worst) to 5 (best), evaluating the relevance, accuracy, directness, and conciseness of the response in direct comparison to a provided reference response..
+                - **Process:**
+                - **Analyze:** Rigorously evaluate the AI's response solely against the reference response for its correctness, relevance, directness, and conciseness.
+                - **Scoring:**
+                    - **1 (Poor):** The response is significantly inaccurate or irrelevant compared to the reference, includes much extraneous information, or fails to adhere to the format and essence of the reference.
+                    - **2 (Fair):** The response, while showing some alignment with the reference, includes notable inaccuracies or irrelevant content and lacks brevity.
+                    - **3 (Good):** The response aligns fairly well with the reference but includes slight inaccuracies or unnecessary details that affect its overall precision and conciseness.
+                    - **4 (Very Good):** The response is almost fully aligned with the reference in terms of precision, relevance, and conciseness, with only minor discrepancies.
+                    - **5 (Excellent):** The response perfectly matches the reference in all aspects—precision, relevance, directness, and conciseness—without any deviations or errors.
+                - **Feedback:**
+                    - Provide a concise justification for the assigned score, focusing strictly on how well the AI's response mirrors the reference in terms of precision, relevance, directness, and conciseness. Highlight even minor discrepancies in high-scoring responses to justify not achieving a perfect score.
+
+                - **Examples for guidance:**
+                [Few-shot examples given by the user]'"""
+    elif set(input_variables) == {'input', 'response', 'context'}:
+        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
+
+                ### **Contextual Groundedness Evaluation**
+
+                **Example Format**
+
+                QUESTION:
+
+                CONTEXT:
+
+                AI ASSISTANT ANSWER:
+
+                —
+
+                SCORE:
+
+                CRITIQUE:
+
+                You are an evaluator scoring responses from an AI assistant. You are provided with a question, the specific context it pertains to, and the AI's answer. Score the AI’s answer from 1 (worst) to 5 (best), focusing on how well it is grounded in the given context.
+
+                **Evaluation Objective**: This evaluation measures the degree to which the AI's responses are grounded in the context provided. It assesses the relevance and adherence to the specifics of the context, highlighting the importance of accurately reflecting the nuances and details presented.
+
+                **Process**:
+
+                1. **Review**: Start by thoroughly examining the AI's response in relation to the context provided. Evaluate how effectively the response incorporates and aligns with key aspects of the context, enhancing its relevance and accuracy.
+                2. **Scoring**:
+                    - **1 (Poor)**: The response shows a significant disregard for or misinterpretation of the context, missing key details.
+                    - **2 (Fair)**: The response demonstrates some connection to the context but includes notable inaccuracies or omissions.
+                    - **3 (Good)**: The response is mostly consistent with the context, with only minor errors or misalignments.
+                    - **4 (Very Good)**: The response is well-aligned with the context, showing a deep understanding and minimal discrepancies.
+                    - **5 (Excellent)**: Represents an exemplary standard of perfect contextual adherence, which, while challenging to achieve, serves as a goal for absolute precision in contextual grounding.
+                3. **Feedback**: Provide focused feedback on how well the response adheres to the context. Identify specific instances where the AI effectively used or failed to use contextual cues, discussing the impact of these cues on the accuracy and relevance of the answer. Keep the feedback succinct and targeted, directly addressing the response's strengths and areas for improvement in terms of contextual groundedness.
+
+                - **Examples for guidance:**
+                [Few-shot examples given by the user]"""
+    elif set(input_variables) == {'input', 'response'}:
+        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
+
+                ### **Formattings:**
+
+                Return a score for the number of different formattings present in the model response. Recognized formattings include: list (numbered or bullet pointed), a markdown table, unformatted text, or a legal memorandum. Text that directly follows a markdown table and refers to its content should be considered as an extension of the markdown table formatting. For instance, the explanatory text following the markdown table about missing information from the table (e.g., "Please note that some information such as the names of the CEOs for CHARANGA SL, the registered office for NEPTUNE GETAFE PROPCO, S.L.U., and the capital figure for CHARANGA SL were not provided in the attachments.") should be counted as part of the markdown table and not classified as unformatted text. Conversely, text completely unrelated to the content of the markdown table or legal memorandum should be considered separately as unformatted text. If a list appears within a legal memorandum, count it as part of the legal memorandum format and not as a separate formatting type.
+
+                **Process:**
+
+                **Analyze:** Examine the AI's response to determine how many types of formatting are used, according to the specific formatting criteria outlined above.
+
+                **Scoring:**
+
+                - Allocate one point for each distinct type of formatting identified. The score should only be 0 if the response is empty — even a single character of text otherwise warrants a point.
+
+                **Feedback:**
+
+                - Provide feedback listing the different formats detected in the response, in order of appearance. For example: ['table', 'unformatted text']. The types of formatting used should be listed separated by commas, and the string returned should be wrapped in square brackets.
+
+                - **Examples for guidance:**
+                [Few-shot examples given by the user]"""
+        
+    elif set(input_variables) == {"input", "response", "context", "reference"}:
+        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
+        '### Hallucination Detection Evaluation:
+        Example Format
+
+        QUESTION:
+
+        CONTEXT:
+
+        REFERENCE RESPONSE:
+
+        AI ASSISTANT ANSWER:
+
+        —
+
+        SCORE:
+
+        CRITIQUE:
+
+        **Objective: Identify any claims in the AI response that are not supported by either the context or the reference response. Score responses from 1 (worst) to 3 (best).
+        Process:
+        Analyze: Carefully compare the AI's response against both the context and the reference response to detect unsupported claims (hallucinations).
+        Scoring:
+        1 (Poor): The response includes significant hallucinations not supported by the context or reference response.
+        2 (Fair): The response has some minor hallucinations, but the overall message aligns with the context and reference response.
+        3 (Good): The response contains no hallucinations and is fully supported by the context and reference response.
+        Feedback:
+        
+        Provide a concise justification for the assigned score, highlighting any hallucinations and explaining why they affect the response's accuracy and relevance.
+
+        Examples for guidance:
+        [Few-shot examples given by the user]"""
+
+    else:
+        raise ValueError(f"Unsupported input variables: {sorted(input_variables)}")
+
+    return system_prompt
+
+
+def format_examples(examples, input_variables):
+    # Render the few-shot examples into the block appended to the user prompt
+    parts = []
+    for i, example in enumerate(examples, 1):
+        parts.append(f"Example {i}:\n")
+        parts.append(f"Input: {example.get('input', '')}\n\n")
+        parts.append(f"Response: {example.get('response', '')}\n\n")
+        if "reference" in input_variables:
+            parts.append(f"Reference: {example.get('reference', '')}\n\n")
+        if "context" in input_variables:
+            parts.append(f"Context: {example.get('context', '')}\n\n")
+        parts.append(f"Score: {example.get('score', '')}\n\n")
+        parts.append(f"Critique: {example.get('critique', '')}\n\n")
+    return "".join(parts)
+
+
+def build_prompt_messages(input_variables, criteria, scoring_rubric, examples=None):
+    system_prompt = select_system_prompt(input_variables)
+
+    user_prompt = f"Evaluation criteria: {criteria}\nScoring rubric: {scoring_rubric}"
+
+    if examples:
+        user_prompt += f"\nFew shot examples: \n\n{examples}"
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+
+    ]
+
+    return messages
+
+
+def generate_prompt(input_variables, criteria, scoring_rubric, examples=None, bypass_cache=False, stream=False, model=DEFAULT_MODEL):
+    messages = build_prompt_messages(input_variables, criteria, scoring_rubric, examples)
+
+    # With stream=True callers get a generator of raw deltas and assemble the prompt themselves
+    if stream:
+        return track_stream("generate_prompt", stream_completion(messages, model=model, bypass_cache=bypass_cache,
+                                                                 operation_name="generate_prompt"))
+
+    with operation("generate_prompt"):
+        content = create_completion(messages, model=model, bypass_cache=bypass_cache)
+    return format_generated_prompt(content)
+
+
+def rewrite_sections(sections, criteria, scoring_rubric, bypass_cache=False, model=DEFAULT_MODEL):
+    # {name: text} of the given sections rewritten for the current criteria and rubric, or None if
+    # the answer doesn't contain every one of them
+    system_prompt = """You are updating part of an existing evaluation prompt. Rewrite only the sections you are given so they match the evaluation criteria and scoring rubric, keeping each section's heading, structure and style. The score range must be exactly as the scoring rubric defines it.
+    Return only the rewritten sections, in the order given, each starting with its heading."""
+    user_prompt = f"Evaluation criteria: {criteria}\nScoring rubric: {scoring_rubric}\n\nSections to rewrite:\n\n"
+    user_prompt += "\n\n".join(text.strip() for text in sections.values())
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    with operation("regenerate_sections"):
+        content = create_completion(messages, model=model, bypass_cache=bypass_cache)
+    rewritten = dict(split_sections(content or "", min_sections=1) or [])
+    if any(name not in rewritten for name in sections):
+        return None
+    return {name: format_generated_prompt(rewritten[name]) for name in sections}
+
+
+def regenerate_prompt(current_prompt, previous_inputs, input_variables, criteria, scoring_rubric, examples=None,
+                      bypass_cache=False, model=DEFAULT_MODEL):
+    """Bring current_prompt (with any manual edits) up to date with the inputs, touching only what changed.
+
+    previous_inputs are the prompt_inputs the prompt was generated from. When only the rubric or
+    the examples changed, the affected sections are rewritten (examples are rendered without a
+    model call) and every other section is kept verbatim. Otherwise, or if the prompt isn't
+    sectioned, the whole prompt is generated again. Returns (prompt, rewritten section names or
+    None for a full regeneration).
+    """
+    affected = changed_sections(previous_inputs, prompt_inputs(input_variables, criteria, scoring_rubric, examples))
+    sections = split_sections(current_prompt) if affected else None
+    if sections:
+        present = dict(sections)
+        replacements = {}
+        if "examples" in affected:
+            replacements["examples"] = render_examples_section(examples)
+        stale = {name: present[name] for name in affected if name != "examples" and name in present}
+        rewritten = rewrite_sections(stale, criteria, scoring_rubric, bypass_cache, model) if stale else {}
+        if rewritten is not None:
+            replacements.update(rewritten)
+            return join_sections(replace_sections(sections, replacements)), sorted(replacements)
+    return generate_prompt(input_variables, criteria, scoring_rubric, examples, bypass_cache=bypass_cache, model=model), None
+
+
+def generate_example(criteria, scoring_rubric, input_variables, existing_example, bypass_cache=False, variant=None, model=DEFAULT_MODEL, avoid=None):
+    system_prompt = """You are an AI assistant tasked with generating an example for an evaluation metric. 
+    Based on the given criteria, scoring rubric, input variables, and an existing example, create a new, similar example."""
+
+    user_prompt = f"""
+    Criteria: {criteria}
+    Scoring Rubric: {scoring_rubric}
+    Input Variables: {input_variables}
+    Existing Example: {existing_example}
+
+    Please generate a new example in JSON format with the following fields:
+    - input    
+    - response
+    - score
+    - critique
+    """
+
+    if "reference" in input_variables:
+        user_prompt += "- reference\n"
+    if "context" in input_variables:
+        user_prompt += "- context\n"
+
+    user_prompt += "\nEnsure the example is similar in style but different in content from the existing example."
+
+    # Examples the model shouldn't hand back, within MAX_AVOID_TOKENS
+    if avoid:
+        user_prompt += "\nThe new example must not repeat or paraphrase any of these examples:\n"
+        user_prompt += truncate_tokens("".join(json.dumps(example, ensure_ascii=False) + "\n" for example in avoid),
+                                       MAX_AVOID_TOKENS, model)
+
+    # Batched requests are numbered so each slot gets its own sample (and its own cache entry)
+    if variant is not None:
+        user_prompt += f"\nThis is variation {variant} of a batch; make it distinct from the other variations."
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+    with operation("generate_example"):
+        return create_completion(messages, model=model, bypass_cache=bypass_cache)
+
+
+def parse_generated_example(generated_example_json, input_variables):
+    # Returns the example as a dict of strings, or None if the model output is not a usable example
+    if not generated_example_json:
+        return None
+    text = generated_example_json.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[len("json"):]
+    try:
+        generated_example = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(generated_example, dict):
+        return None
+
+    required_fields = ["input", "response", "score", "critique"]
+    required_fields += [v for v in ("reference", "context") if v in input_variables]
+    if any(field not in generated_example for field in required_fields):
+        return None
+    return {field: str(value) for field, value in generated_example.items()}
+
+
+def generate_examples(criteria, scoring_rubric, input_variables, existing_examples, n, bypass_cache=False, max_workers=8, model=DEFAULT_MODEL,
+                      example_pool=None, threshold=DEFAULT_THRESHOLD, max_attempts=MAX_EXAMPLE_ATTEMPTS):
+    """Generate n examples concurrently and return (valid_examples, failed_count).
+
+    Each generated example is checked against the existing examples, the examples accepted
+    so far and, if given, an ExamplePool; a near-duplicate is rejected and its slot retried
+    with a fresh request, up to max_attempts requests per slot. Each attempt is a round of
+    concurrent requests whose results are checked in slot order, and a slot's request only
+    lists the existing examples and its own rejected attempts, so the requests made don't
+    depend on thread timing and a run replays from the cache or a cassette. A slot whose
+    request raises counts as failed.
+    """
+    if n <= 0:
+        return [], 0
+    if isinstance(existing_examples, (str, dict)):
+        existing_examples = [existing_examples]
+    existing_examples = [example for example in existing_examples if example]
+    style_example = existing_examples[0] if existing_examples else {}
+
+    index = NearDuplicateIndex(threshold)
+    for example in existing_examples:
+        index.add(example)
+    pool = pool_index(example_pool, threshold) if example_pool is not None else None
+
+    def request_one(slot, attempt, avoid):
+        # Retries get their own variation number, and so their own sample and cache entry
+        return parse_generated_example(
+            generate_example(criteria, scoring_rubric, input_variables, str(style_example), bypass_cache=bypass_cache,
+                             variant=slot + attempt * n, model=model, avoid=avoid),
+            input_variables
+        )
+
+    accepted = {}
+    rejected = {slot: [] for slot in range(1, n + 1)}
+    pending = list(rejected)
+    with ThreadPoolExecutor(max_workers=min(n, max_workers)) as executor:
+        context = contextvars.copy_context()
+        for attempt in range(max_attempts):
+            if not pending:
+                break
+            futures = {slot: executor.submit(context.copy().run, request_one, slot, attempt, existing_examples + rejected[slot])
+                       for slot in pending}
+            retry = []
+            # Checked in slot order, so which of two near-duplicates is kept doesn't depend on timing
+            for slot in pending:
+                try:
+                    generated_example = futures[slot].result()
+                except Exception:
+                    # Counted as failed and not retried; the other slots' examples are still returned
+                    continue
+                if generated_example is None:
+                    retry.append(slot)
+                    continue
+                if pool is None or pool.find(generated_example) is None:
+                    added, _ = index.add_unique(generated_example)
+                    if added:
+                        accepted[slot] = generated_example
+                        continue
+                rejected[slot].append(generated_example)
+                get_registry().inc("llm_generated_duplicates_total", operation="generate_example")
+                retry.append(slot)
+            pending = retry
+
+    generated_examples = [accepted[slot] for slot in sorted(accepted)]
+    return generated_examples, n - len(generated_examples)
+
+
+def run_bounded(fn, items, workers=8):
+    # Yields fn(item) as each call completes, with at most 2x workers items in flight so
+    # arbitrarily long input streams are processed in bounded memory. Workers inherit the
+    # caller's context (e.g. its request priority).
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(context.copy().run, fn, item))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def is_valid_variable_name(name):
+    return re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name) is not None
+
+
+def initialize_new_metric(metric_name):
+    return {
+        "criteria": "",
+        "scoring_rubric": SCORING_RUBRIC_OPTIONS[0],  # Default to the first option
+        "input_variables": ["input", "response"],
+        "prompt": "",
+        "examples": [{}]
+    }
+
+
+reserved_metric_info = {
+    "hallucination": {
+        "criteria": "Assesses presence of incorrect of unrelated content in the AI’s response.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response", "reference"]
+    },
+    "context_relevance": {
+        "criteria": "Measures how on-point the retrieved context is.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response", "context"]
+    },
+
+    "groundedness": {
+        "criteria": "Determines if the response is factually based on the provided context.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response", "context"]
+    },
+
+    "precision": {
+        "criteria": "Assesses the relevance of all the information in the response.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response", "reference"]
+    },
+    
+    "logical_coherence": {
+        "criteria": "Measures the logical flow, consistency, and rationality of the response.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response"]
+    },
+    
+    "recall": {
+        "criteria": "Measures how complete the response captures the key facts and details.",
+        "scoring_rubric": "Likert: 1 - 5",
+        "input_variables": ["input", "response", "reference"]
+    }
+    # Add information for other reserved metrics here
+}
+
+reserved_metrics = list(reserved_metric_info.keys())
@@ -0,0 +1,114 @@
+"""Generated evaluation prompts as sections, so a change to one input only touches its sections.
+
+The prompt templates (and so the generated prompts) are laid out as a header (title and
+example format) followed by Objective, Process, Scoring, Feedback and "Examples for guidance"
+sections. Each metric input feeds some of them: the scoring rubric only shapes the objective
+and scoring sections, and the few-shot examples only the examples section, which is rendered
+locally. Criteria and input variables shape everything, so changing them regenerates the
+whole prompt.
+"""
+import hashlib
+import json
+import re
+
+
+SECTIONS = ("objective", "process", "scoring", "feedback", "examples")
+SECTION_HEADINGS = {
+    "objective": r"(?:Evaluation\s+)?Objective",
+    "process": r"Process",
+    "scoring": r"Scoring",
+    "feedback": r"Feedback",
+    "examples": r"Examples\s+for\s+guidance",
+}
+# A heading is the section name, optionally bulleted or numbered and in bold, followed by a colon
+SECTION_PATTERNS = {
+    name: re.compile(rf"(?:^|(?<=\s))(?:[-*]\s+|\d+\.\s+)?\**\s*{heading}\s*\**\s*:", re.IGNORECASE)
+    for name, heading in SECTION_HEADINGS.items()
+}
+# Sections each input feeds; None means all of them
+SECTION_INPUTS = {
+    "criteria": None,
+    "input_variables": None,
+    "scoring_rubric": ("objective", "scoring"),
+    "examples": ("examples",),
+}
+EXAMPLES_HEADING = "- **Examples for guidance:**"
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False).encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def prompt_inputs(input_variables, criteria, scoring_rubric, examples):
+    """Digests of the inputs a prompt is generated from, in the form changed_sections compares.
+
+    Sessions keep these for every metric, so they hold a hash per input rather than the
+    formatted examples text.
+    """
+    return {"input_variables": _digest(sorted(input_variables)), "criteria": _digest(criteria),
+            "scoring_rubric": _digest(scoring_rubric), "examples": _digest(examples or "")}
+
+
+def split_sections(prompt, min_sections=2):
+    """[(name, text), ...] covering the whole prompt, starting with ("header", ...); None if it isn't sectioned.
+
+    Each section runs from its heading to the next section's heading; only the first heading
+    of each name counts, so e.g. a "Scoring:" bullet inside the process section starts the
+    scoring section.
+    """
+    starts = []
+    for name, pattern in SECTION_PATTERNS.items():
+        match = pattern.search(prompt or "")
+        if match:
+            starts.append((match.start(), name))
+    if len(starts) < min_sections:
+        return None
+    starts.sort()
+    sections = [("header", prompt[:starts[0][0]])]
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(prompt)
+        sections.append((name, prompt[start:end]))
+    return sections
+
+
+def join_sections(sections):
+    return "".join(text for _, text in sections)
+
+
+def changed_sections(previous_inputs, inputs):
+    """Sections affected by the inputs that changed; None if the whole prompt must be regenerated."""
+    if not previous_inputs:
+        return None
+    affected = set()
+    for name, value in inputs.items():
+        if previous_inputs.get(name) == value:
+            continue
+        sections = SECTION_INPUTS.get(name)
+        if sections is None:
+            return None
+        affected.update(sections)
+    return [name for name in SECTIONS if name in affected]
+
+
+def render_examples_section(examples):
+    return f"{EXAMPLES_HEADING}\n{examples}" if examples else f"{EXAMPLES_HEADING}\nNone.\n"
+
+
+def replace_sections(sections, replacements):
+    """Sections with the given {name: text} swapped in, keeping each replaced section's trailing whitespace.
+
+    A replacement for a section the prompt doesn't have is appended at the end.
+    """
+    updated = []
+    for name, text in sections:
+        if name in replacements:
+            trailing = text[len(text.rstrip()):]
+            text = replacements[name].strip() + (trailing or " ")
+        updated.append((name, text))
+    present = {name for name, _ in sections}
+    for name, text in replacements.items():
+        if name not in present:
+            if updated and not updated[-1][1].endswith(("\n", " ")):
+                updated[-1] = (updated[-1][0], updated[-1][1] + "\n\n")
+            updated.append((name, text.strip() + "\n"))
+    return updated
@@ -0,0 +1,206 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import openai
+
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 10
+
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", "500"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE", "200000"))
+# Budget reserved for the completion until the real usage is known
+DEFAULT_COMPLETION_TOKENS = 512
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+_current_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    # Calls made inside the block (and in worker threads started with a copy of this context) use `priority`
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+def estimate_tokens(messages, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    # Rough pre-call estimate (~4 characters per token); corrected from completion.usage afterwards
+    prompt_tokens = sum(len(message["content"]) // 4 + 4 for message in messages)
+    return prompt_tokens + completion_tokens
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute) if per_minute else None
+        self.level = self.capacity
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.capacity is not None:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        # Positive charges extra usage (the level may go negative), negative refunds an overestimate
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """Process-wide token bucket for requests/min and tokens/min with priority-ordered waiters."""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue_depth = 0
+
+    def acquire(self, tokens=0, priority=None):
+        """Block until the request fits both budgets and no higher-priority caller is waiting; returns the wait in seconds."""
+        if priority is None:
+            priority = current_priority()
+        ticket = (priority, next(self._seq))
+        started = time.monotonic()
+
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            try:
+                while True:
+                    delay = None
+                    if self._queue[0] == ticket:
+                        now = time.monotonic()
+                        delay = max(self._paused_until - now, self._requests.delay(1, now), self._tokens.delay(tokens, now))
+                        if delay <= 0:
+                            self._requests.take(1)
+                            self._tokens.take(tokens)
+                            break
+                    self._cond.wait(delay)
+            finally:
+                if self._queue and self._queue[0] == ticket:
+                    heapq.heappop(self._queue)
+                elif ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            self.acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if waited > 0.001:
+                self.throttled += 1
+        return waited
+
+    def adjust_tokens(self, amount):
+        with self._cond:
+            self._tokens.adjust(amount)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        # A 429 means the server-side quota is exhausted: hold every caller, not just the one that got it
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def record_retry(self):
+        with self._cond:
+            self.retries += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(fn, limiter, tokens=0, priority=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """Run fn() under the limiter, retrying transient API errors with full-jitter exponential backoff."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens, priority)
+        try:
+            return fn()
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            limiter.record_retry()
+            delay = _retry_after(e) or random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if isinstance(e, openai.RateLimitError):
+                # The pause makes the retry (and everyone else) wait in acquire()
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def set_limiter(limiter):
+    global _default_limiter
+    with _default_limiter_lock:
+        _default_limiter = limiter
+
+
+def get_limiter():
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
@@ -0,0 +1,317 @@
+"""Compact in-session storage for metrics and examples.
+
+Each Streamlit session keeps its metrics and their few-shot examples; with many sessions and
+long contexts pasted into examples, plain nested dicts of strings make the server's memory
+grow with every user. Here metrics and examples are slotted records (no per-record dict,
+field names shared by the class) whose dict-style access (get, [], items) matches the dicts
+they replace. Text longer than INLINE_LIMIT is put in a process-wide TextStore by content
+hash, so every session holding the same text shares one copy, and only a bounded cache of
+recently used texts is resident; the rest lives in a per-process SQLite file. A text is
+deleted once no record refers to it any more.
+"""
+import atexit
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import weakref
+from collections import OrderedDict, deque
+
+
+# Shorter text stays inline in the record
+INLINE_LIMIT = 256
+# Resident budget for stored texts across all sessions; least recently used texts beyond it are read back from disk
+DEFAULT_CACHE_BYTES = int(os.environ.get("SESSION_TEXT_CACHE_BYTES", 32 * 1024 * 1024))
+EXAMPLE_FIELDS = ("input", "response", "reference", "context", "score", "critique")
+METRIC_FIELDS = ("name", "criteria", "scoring_rubric", "input_variables", "prompt", "examples", "version", "tags", "updated_at")
+
+
+class TextRef:
+    # One TextRef per stored text, shared by every record holding it; copies are the same object
+    __slots__ = ("key", "length", "__weakref__")
+
+    def __init__(self, key, length):
+        self.key = key
+        self.length = length
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class TextStore:
+    """Content-addressed text storage: each distinct text is written once and kept resident while hot.
+
+    Texts only need to outlive the sessions of this server process, so each process writes
+    its own file and removes it on exit. The store hands out one TextRef per text and watches
+    it with a weak reference; when the last record holding it is gone, the text is queued and
+    deleted on the next put or stats call.
+    """
+
+    def __init__(self, path=None, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.path = path or os.path.join(".cache", f"session_texts_{os.getpid()}.sqlite3")
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._resident = 0
+        self._stored = {}
+        self._refs = {}
+        self._released = deque()
+        self.reads = 0
+        self.deleted = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS texts (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+
+    def put(self, text):
+        """A TextRef for text, storing it if it is new."""
+        key = hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+        with self._lock:
+            self._purge()
+            ref = self._refs.get(key)
+            ref = ref() if ref is not None else None
+            if ref is None:
+                if key not in self._stored:
+                    self._conn.execute("INSERT OR IGNORE INTO texts (key, text) VALUES (?, ?)", (key, text))
+                    self._conn.commit()
+                    self._stored[key] = len(text)
+                ref = TextRef(key, len(text))
+                # Runs from garbage collection, possibly while the lock is held; only queues the key
+                self._refs[key] = weakref.ref(ref, lambda _, key=key: self._released.append(key))
+            self._remember(key, text)
+        return ref
+
+    def get(self, ref):
+        with self._lock:
+            text = self._cache.get(ref.key)
+            if text is not None:
+                self._cache.move_to_end(ref.key)
+                return text
+            self.reads += 1
+            text = self._conn.execute("SELECT text FROM texts WHERE key = ?", (ref.key,)).fetchone()[0]
+            self._remember(ref.key, text)
+            return text
+
+    def _purge(self):
+        # Delete released texts, unless a new TextRef was handed out for them since
+        keys = []
+        while self._released:
+            key = self._released.popleft()
+            ref = self._refs.get(key)
+            if ref is not None and ref() is not None:
+                continue
+            self._refs.pop(key, None)
+            if self._stored.pop(key, None) is None:
+                continue
+            text = self._cache.pop(key, None)
+            if text is not None:
+                self._resident -= sys.getsizeof(text)
+            keys.append((key,))
+        if keys:
+            self._conn.executemany("DELETE FROM texts WHERE key = ?", keys)
+            self._conn.commit()
+            self.deleted += len(keys)
+
+    def purge(self):
+        with self._lock:
+            self._purge()
+
+    def _remember(self, key, text):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return
+        self._cache[key] = text
+        self._resident += sys.getsizeof(text)
+        while self._resident > self.cache_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._resident -= sys.getsizeof(evicted)
+
+    def stats(self):
+        with self._lock:
+            self._purge()
+            return {"texts": len(self._stored), "chars": sum(self._stored.values()), "resident_bytes": self._resident,
+                    "cached": len(self._cache), "disk_reads": self.reads, "deleted": self.deleted}
+
+    def close(self, remove=True):
+        with self._lock:
+            self._conn.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+_text_store = None
+_text_store_lock = threading.Lock()
+
+
+def set_text_store(store):
+    global _text_store
+    with _text_store_lock:
+        _text_store = store
+
+
+def get_text_store():
+    global _text_store
+    with _text_store_lock:
+        if _text_store is None:
+            _text_store = TextStore()
+            atexit.register(_text_store.close)
+        return _text_store
+
+
+def compact_text(value):
+    if isinstance(value, str) and len(value) > INLINE_LIMIT:
+        return get_text_store().put(value)
+    return value
+
+
+def _resolve(value):
+    return get_text_store().get(value) if isinstance(value, TextRef) else value
+
+
+class Record:
+    """Slotted record with the read/write interface of the dict it replaces."""
+
+    __slots__ = ("_extra",)
+    FIELDS = ()
+
+    def __init__(self, data=None):
+        self._extra = None
+        for field in self.FIELDS:
+            object.__setattr__(self, field, None)
+        for field, value in (data or {}).items():
+            self[field] = value
+
+    def _compact(self, field, value):
+        return compact_text(value)
+
+    def __setitem__(self, field, value):
+        value = self._compact(field, value)
+        if field in self.FIELDS:
+            object.__setattr__(self, field, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[sys.intern(field)] = value
+
+    def _raw(self, field):
+        if field in self.FIELDS:
+            return getattr(self, field)
+        return (self._extra or {}).get(field)
+
+    def get(self, field, default=None):
+        value = self._raw(field)
+        return default if value is None else _resolve(value)
+
+    def __getitem__(self, field):
+        value = self._raw(field)
+        if value is None:
+            raise KeyError(field)
+        return _resolve(value)
+
+    def __delitem__(self, field):
+        if self._raw(field) is None:
+            raise KeyError(field)
+        if field in self.FIELDS:
+            object.__setattr__(self, field, None)
+        else:
+            del self._extra[field]
+
+    def __contains__(self, field):
+        return self._raw(field) is not None
+
+    def keys(self):
+        return [field for field in self.FIELDS if getattr(self, field) is not None] + list(self._extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(field, self[field]) for field in self.keys()]
+
+    def to_dict(self):
+        return {field: to_plain(value) for field, value in self.items()}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def memory(self):
+        """(bytes held by this record, chars it references in the text store)."""
+        resident, stored = footprint([getattr(self, field) for field in self.FIELDS] + list((self._extra or {}).values()))
+        return resident - sys.getsizeof([]) + sys.getsizeof(self), stored
+
+
+class ExampleRecord(Record):
+    __slots__ = EXAMPLE_FIELDS
+    FIELDS = EXAMPLE_FIELDS
+
+
+class MetricRecord(Record):
+    __slots__ = METRIC_FIELDS
+    FIELDS = METRIC_FIELDS
+
+    def _compact(self, field, value):
+        # Rubrics, input variables and tags come from small vocabularies; one copy of each per process
+        if field == "examples":
+            return [compact_example(example) for example in value or []]
+        if field in ("input_variables", "tags") and value is not None:
+            return tuple(sys.intern(str(item)) for item in value)
+        if field == "scoring_rubric" and isinstance(value, str):
+            return sys.intern(value)
+        return compact_text(value)
+
+
+def compact_example(example):
+    return example if isinstance(example, ExampleRecord) else ExampleRecord(example)
+
+
+def compact_metric(metric):
+    return metric if isinstance(metric, MetricRecord) else MetricRecord(metric)
+
+
+def to_plain(value):
+    """Records, and lists and dicts of them, as plain dicts and lists, e.g. for the metric store or json.dumps."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    return value
+
+
+def footprint(value):
+    """(bytes, text store chars) of a value built from records, strings, numbers, lists and dicts.
+
+    Other objects (jobs, traces) count as nothing: they aren't metric or example data.
+    """
+    if isinstance(value, Record):
+        return value.memory()
+    if isinstance(value, TextRef):
+        return sys.getsizeof(value), value.length
+    if isinstance(value, (str, int, float)):
+        return sys.getsizeof(value), 0
+    if isinstance(value, dict):
+        items = list(value.values())
+    elif isinstance(value, (list, tuple)):
+        items = list(value)
+    else:
+        return 0, 0
+    resident, stored = sys.getsizeof(value), 0
+    for item in items:
+        inner = footprint(item)
+        resident, stored = resident + inner[0], stored + inner[1]
+    return resident, stored
+
+
+def session_memory(state):
+    """(bytes, text store chars) of one session's metrics, examples and widget text."""
+    return footprint({key: state[key] for key in list(state.keys())})
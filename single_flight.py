@@ -0,0 +1,146 @@
+import collections
+import threading
+
+
+MAX_TRACKED_KEYS = 1000
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SharedStream:
+    # Chunks are buffered so late subscribers replay from the start. Whichever subscriber
+    # reaches the end of the buffer pulls the next chunk, so the stream keeps flowing even
+    # if the subscriber that started it goes away.
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._source = None
+        self._lock = threading.Lock()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+
+    def _pull(self, index):
+        with self._lock:
+            if len(self.chunks) > index or self.done:
+                return
+            try:
+                if self._source is None:
+                    self._source = iter(self._factory())
+                self.chunks.append(next(self._source))
+            except StopIteration:
+                self.done = True
+            except BaseException as e:
+                self.error = e
+                self.done = True
+
+    def iterate(self):
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                self._pull(index)
+
+    def close(self):
+        with self._lock:
+            if self._source is not None and hasattr(self._source, "close"):
+                self._source.close()
+            self.done = True
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution whose result every caller shares."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.coalesced = 0
+        # Per-key count of callers that piggy-backed on an in-flight call, most recent keys only
+        self.waits = collections.OrderedDict()
+
+    def _record_wait(self, key):
+        self.coalesced += 1
+        self.waits[key] = self.waits.pop(key, 0) + 1
+        if len(self.waits) > MAX_TRACKED_KEYS:
+            self.waits.popitem(last=False)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._record_wait(key)
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stream(self, key, factory):
+        # Generator counterpart of do(): factory() returns an iterator that is consumed once and fanned out
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _SharedStream(factory)
+            else:
+                self._record_wait(key)
+            shared.subscribers += 1
+
+        try:
+            yield from shared.iterate()
+        finally:
+            with self._lock:
+                shared.subscribers -= 1
+                abandoned = shared.subscribers == 0 and not shared.done
+                if (shared.done or abandoned) and self._streams.get(key) is shared:
+                    del self._streams[key]
+            if abandoned:
+                shared.close()
+
+    def stats(self, top=5):
+        with self._lock:
+            busiest = sorted(self.waits.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "coalesced": self.coalesced,
+                "top_keys": busiest,
+            }
+
+
+_default_single_flight = None
+_default_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    global _default_single_flight
+    with _default_single_flight_lock:
+        if _default_single_flight is None:
+            _default_single_flight = SingleFlight()
+        return _default_single_flight
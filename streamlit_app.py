@@ -1,297 +1,448 @@
 import streamlit as st
-import textwrap
-from openai import OpenAI
-import re
-import os
+import io
 import json
-
-
-openai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-
-def generate_prompt(input_variables, criteria, scoring_rubric, examples=None):
-
-    if set(input_variables) == {'input', 'response', 'reference'}:
-        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
-                '### **Precision and Conciseness Evaluation:**
-                **Example Format**
-
-                  QUESTION:
-
-                  REFERENCE RESPONSE:
-
-                  AI ASSISTANT ANSWER:
-
-                  —
-
-                  SCORE:
-
-                  CRITIQUE:
-
-                - **Objective: Assess responses from any AI model on a scale from 1 (worst) to 5 (best), evaluating the relevance, accuracy, directness, and conciseness of the response in direct comparison to a provided reference response..
-                - **Process:**
-                - **Analyze:** Rigorously evaluate the AI's response solely against the reference response for its correctness, relevance, directness, and conciseness.
-                - **Scoring:**
-                    - **1 (Poor):** The response is significantly inaccurate or irrelevant compared to the reference, includes much extraneous information, or fails to adhere to the format and essence of the reference.
-                    - **2 (Fair):** The response, while showing some alignment with the reference, includes notable inaccuracies or irrelevant content and lacks brevity.
-                    - **3 (Good):** The response aligns fairly well with the reference but includes slight inaccuracies or unnecessary details that affect its overall precision and conciseness.
-                    - **4 (Very Good):** The response is almost fully aligned with the reference in terms of precision, relevance, and conciseness, with only minor discrepancies.
-                    - **5 (Excellent):** The response perfectly matches the reference in all aspects—precision, relevance, directness, and conciseness—without any deviations or errors.
-                - **Feedback:**
-                    - Provide a concise justification for the assigned score, focusing strictly on how well the AI's response mirrors the reference in terms of precision, relevance, directness, and conciseness. Highlight even minor discrepancies in high-scoring responses to justify not achieving a perfect score.
-
-                - **Examples for guidance:**
-                [Few-shot examples given by the user]'"""
-    elif set(input_variables) == {'input', 'response', 'context'}:
-        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
-
-                ### **Contextual Groundedness Evaluation**
-
-                **Example Format**
-
-                QUESTION:
-
-                CONTEXT:
-
-                AI ASSISTANT ANSWER:
-
-                —
-
-                SCORE:
-
-                CRITIQUE:
-
-                You are an evaluator scoring responses from an AI assistant. You are provided with a question, the specific context it pertains to, and the AI's answer. Score the AI’s answer from 1 (worst) to 5 (best), focusing on how well it is grounded in the given context.
-
-                **Evaluation Objective**: This evaluation measures the degree to which the AI's responses are grounded in the context provided. It assesses the relevance and adherence to the specifics of the context, highlighting the importance of accurately reflecting the nuances and details presented.
-
-                **Process**:
-
-                1. **Review**: Start by thoroughly examining the AI's response in relation to the context provided. Evaluate how effectively the response incorporates and aligns with key aspects of the context, enhancing its relevance and accuracy.
-                2. **Scoring**:
-                    - **1 (Poor)**: The response shows a significant disregard for or misinterpretation of the context, missing key details.
-                    - **2 (Fair)**: The response demonstrates some connection to the context but includes notable inaccuracies or omissions.
-                    - **3 (Good)**: The response is mostly consistent with the context, with only minor errors or misalignments.
-                    - **4 (Very Good)**: The response is well-aligned with the context, showing a deep understanding and minimal discrepancies.
-                    - **5 (Excellent)**: Represents an exemplary standard of perfect contextual adherence, which, while challenging to achieve, serves as a goal for absolute precision in contextual grounding.
-                3. **Feedback**: Provide focused feedback on how well the response adheres to the context. Identify specific instances where the AI effectively used or failed to use contextual cues, discussing the impact of these cues on the accuracy and relevance of the answer. Keep the feedback succinct and targeted, directly addressing the response's strengths and areas for improvement in terms of contextual groundedness.
-
-                - **Examples for guidance:**
-                [Few-shot examples given by the user]"""
-    elif set(input_variables) == {'input', 'response'}:
-        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
-
-                ### **Formattings:**
-
-                Return a score for the number of different formattings present in the model response. Recognized formattings include: list (numbered or bullet pointed), a markdown table, unformatted text, or a legal memorandum. Text that directly follows a markdown table and refers to its content should be considered as an extension of the markdown table formatting. For instance, the explanatory text following the markdown table about missing information from the table (e.g., "Please note that some information such as the names of the CEOs for CHARANGA SL, the registered office for NEPTUNE GETAFE PROPCO, S.L.U., and the capital figure for CHARANGA SL were not provided in the attachments.") should be counted as part of the markdown table and not classified as unformatted text. Conversely, text completely unrelated to the content of the markdown table or legal memorandum should be considered separately as unformatted text. If a list appears within a legal memorandum, count it as part of the legal memorandum format and not as a separate formatting type.
-
-                **Process:**
-
-                **Analyze:** Examine the AI's response to determine how many types of formatting are used, according to the specific formatting criteria outlined above.
-
-                **Scoring:**
-
-                - Allocate one point for each distinct type of formatting identified. The score should only be 0 if the response is empty — even a single character of text otherwise warrants a point.
-
-                **Feedback:**
-
-                - Provide feedback listing the different formats detected in the response, in order of appearance. For example: ['table', 'unformatted text']. The types of formatting used should be listed separated by commas, and the string returned should be wrapped in square brackets.
-
-                - **Examples for guidance:**
-                [Few-shot examples given by the user]"""
-        
-    elif set(input_variables) == {"input", "response", "context", "reference"}:
-        system_prompt = """Please create an evaluation prompt based on the user specified criteria and scoring rubric (and additionally some examples if defined in the user prompt). The scoring rubric in the prompt should always be as the user defines it (e.g., the score range should be 1 - 3 if the user defines it as such rather than the 1 - 5 in the example below). You can use the below template as a guide for how it should be set up:
-        '### Hallucination Detection Evaluation:
-        Example Format
-
-        QUESTION:
-
-        CONTEXT:
-
-        REFERENCE RESPONSE:
-
-        AI ASSISTANT ANSWER:
-
-        —
-
-        SCORE:
-
-        CRITIQUE:
-
-        **Objective: Identify any claims in the AI response that are not supported by either the context or the reference response. Score responses from 1 (worst) to 3 (best).
-        Process:
-        Analyze: Carefully compare the AI's response against both the context and the reference response to detect unsupported claims (hallucinations).
-        Scoring:
-        1 (Poor): The response includes significant hallucinations not supported by the context or reference response.
-        2 (Fair): The response has some minor hallucinations, but the overall message aligns with the context and reference response.
-        3 (Good): The response contains no hallucinations and is fully supported by the context and reference response.
-        Feedback:
-        
-        Provide a concise justification for the assigned score, highlighting any hallucinations and explaining why they affect the response's accuracy and relevance.
-
-        Examples for guidance:
-        [Few-shot examples given by the user]"""
-
-    user_prompt = f"Evaluation criteria: {criteria}\nScoring rubric: {scoring_rubric}"
-
-    if examples:
-        user_prompt += f"\nFew shot examples: \n\n{examples}"
-
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-
-    ]
-
-    completion = openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages
-    )
-
-    if completion.choices:
-        formatted_text = textwrap.fill(completion.choices[0].message.content, width=80)
-        print(formatted_text)
-    else:
-        print("No completion found.")
-
-    return formatted_text
-
-def generate_example(criteria, scoring_rubric, input_variables, existing_example):
-    system_prompt = """You are an AI assistant tasked with generating an example for an evaluation metric. 
-    Based on the given criteria, scoring rubric, input variables, and an existing example, create a new, similar example."""
-
-    user_prompt = f"""
-    Criteria: {criteria}
-    Scoring Rubric: {scoring_rubric}
-    Input Variables: {input_variables}
-    Existing Example: {existing_example}
-
-    Please generate a new example in JSON format with the following fields:
-    - input    
-    - response
-    - score
-    - critique
-    """
-
-    if "reference" in input_variables:
-        user_prompt += "- reference\n"
-    if "context" in input_variables:
-        user_prompt += "- context\n"
-
-    user_prompt += "\nEnsure the example is similar in style but different in content from the existing example."
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
-
-    completion = openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages
+import time
+from collections import deque
+from openai import OpenAI
+import prompt_engineer
+from prompt_engineer import (
+    format_examples,
+    format_generated_prompt,
+    generate_examples,
+    generate_prompt,
+    initialize_new_metric,
+    is_valid_variable_name,
+    regenerate_prompt,
+    reserved_metric_info,
+    reserved_metrics,
+    select_system_prompt,
+)
+from prompt_budget import context_window, token_breakdown
+from prompt_sections import changed_sections, prompt_inputs
+from llm_cache import get_cache
+from rate_limiter import get_limiter
+from single_flight import get_single_flight
+from jobs import CANCELLED, DONE, FAILED, TIMED_OUT, get_executor
+from metric_store import get_store, parse_tags
+from metric_bundle import write_bundle
+from profiler import PROFILE_BY_DEFAULT, chrome_trace, end_trace, start_trace
+from session_store import ExampleRecord, compact_example, compact_metric, get_text_store, session_memory, to_plain
+from telemetry import start_metrics_server_from_env
+
+
+prompt_engineer.set_client(OpenAI(api_key=st.secrets["OPENAI_API_KEY"], max_retries=0))
+# Prometheus endpoint, when METRICS_PORT is set; started once per server process
+start_metrics_server_from_env()
+
+# Reruns kept for the profiling panel
+PROFILE_HISTORY = 20
+
+RESERVED_METRIC_NAMES = {name.lower() for name in reserved_metrics}
+
+# Seconds before a background generation is abandoned
+PROMPT_JOB_DEADLINE = 120
+EXAMPLES_JOB_DEADLINE = 180
+
+def start_job(job_id, kind, metric_name, target=None, **meta):
+    # Jobs run in the process-level executor; the session only keeps their ids, so they survive reruns
+    st.session_state.jobs[job_id] = {"kind": kind, "metric": metric_name, "target": target, **meta}
+    st.rerun()
+
+def session_jobs(metric_name, kind):
+    return [(job_id, meta) for job_id, meta in list(st.session_state.jobs.items()) if meta["metric"] == metric_name and meta["kind"] == kind]
+
+def finished_job(job_id):
+    # Returns the job once it has finished (and forgets it), or None while it is still running
+    job = get_executor().get(job_id)
+    if job is None:
+        del st.session_state.jobs[job_id]
+        st.warning("A background generation was lost (the server may have restarted).")
+        return None
+    if not job.is_finished:
+        return None
+    del st.session_state.jobs[job_id]
+    if job.status == FAILED:
+        st.error(f"An error occurred: {str(job.error)}")
+    elif job.status == TIMED_OUT:
+        st.error("Generation timed out.")
+    elif job.status == CANCELLED:
+        st.info("Generation cancelled.")
+    return job
+
+def show_running_job(job_id, label):
+    # Live view of a running job; follow_running_jobs() keeps it updated at the end of the script
+    job = get_executor().get(job_id)
+    st.caption(label)
+    placeholder = st.empty()
+    placeholder.text(job.text)
+    if st.button("Cancel", key=f"cancel_{job_id}"):
+        get_executor().cancel(job_id)
+        st.rerun()
+    running_jobs.append((job, placeholder))
+
+def follow_running_jobs():
+    # Stream partial output into the placeholders until a job finishes, then rerun to apply it.
+    # Any widget interaction interrupts this loop; the jobs themselves keep running.
+    while running_jobs:
+        for job, placeholder in running_jobs:
+            # get() also enforces the job's deadline; a pruned job is reported as lost on the rerun
+            current = get_executor().get(job.id)
+            if current is None or current.is_finished:
+                st.rerun()
+            placeholder.text(job.text)
+        time.sleep(0.1)
+
+def apply_prompt_jobs(metric_name):
+    for job_id, meta in session_jobs(metric_name, "prompt"):
+        job = finished_job(job_id)
+        if job is None:
+            if job_id in st.session_state.jobs:
+                show_running_job(job_id, "Generating prompt...")
+            continue
+        if job.status != DONE:
+            continue
+
+        if meta.get("sections"):
+            generated_prompt, rewritten = job.result
+        else:
+            generated_prompt, rewritten = format_generated_prompt(job.result), None
+        if not generated_prompt:
+            st.error("Failed to generate prompt.")
+            continue
+
+        if meta["target"] == "custom" and metric_name in st.session_state.custom_metrics:
+            st.session_state.custom_metrics[metric_name]["prompt"] = generated_prompt
+            st.session_state.prompt_inputs[metric_name] = meta["inputs"]
+        else:
+            st.session_state.temp_prompt = generated_prompt
+            st.session_state.temp_prompt_inputs = meta["inputs"]
+            st.session_state.editing_metric = metric_name
+        if rewritten:
+            st.success(f"Updated the {', '.join(rewritten)} section(s); the rest of the prompt was kept as is.")
+        else:
+            st.success("Prompt generated successfully!")
+
+def start_prompt_job(metric_name, target, input_variables, criteria, scoring_rubric, examples, current_prompt=None):
+    # With an existing prompt, only the sections fed by the changed inputs are regenerated, keeping manual edits elsewhere
+    inputs = prompt_inputs(input_variables, criteria, scoring_rubric, examples)
+    previous_inputs = st.session_state.prompt_inputs.get(metric_name) if target == "custom" else st.session_state.get("temp_prompt_inputs")
+    if current_prompt and changed_sections(previous_inputs, inputs):
+        job_id = get_executor().submit(
+            regenerate_prompt, current_prompt, previous_inputs, input_variables, criteria, scoring_rubric, examples,
+            bypass_cache=bypass_cache, kind="regenerate_prompt", deadline=PROMPT_JOB_DEADLINE
+        )
+        start_job(job_id, "prompt", metric_name, target, inputs=inputs, sections=True)
+        return
+    job_id = get_executor().submit_stream(
+        lambda: generate_prompt(input_variables, criteria, scoring_rubric, examples, bypass_cache=bypass_cache, stream=True),
+        kind="generate_prompt",
+        deadline=PROMPT_JOB_DEADLINE
     )
-
-    if completion.choices:
-        return completion.choices[0].message.content
-    else:
+    start_job(job_id, "prompt", metric_name, target, inputs=inputs)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def prompt_size(input_variables, criteria, scoring_rubric, examples):
+    # Tokenizing the template and examples dominates; memoized on the exact inputs
+    try:
+        system_prompt = select_system_prompt(input_variables)
+    except ValueError:
         return None
+    return token_breakdown({
+        "template": system_prompt,
+        "criteria": f"Evaluation criteria: {criteria}\nScoring rubric: {scoring_rubric}",
+        "examples": examples,
+    }, prompt_engineer.DEFAULT_MODEL)
+
+def show_prompt_tokens(input_variables, criteria, scoring_rubric, examples):
+    # Size of the prompt-generation request, measured before it is sent
+    tokens = prompt_size(tuple(input_variables), criteria, scoring_rubric, examples)
+    if tokens is None:
+        return
+    st.caption(f"Prompt size: {tokens['total']} of {context_window(prompt_engineer.DEFAULT_MODEL)} tokens "
+               f"(template {tokens['template']}, criteria {tokens['criteria']}, examples {tokens['examples']})")
 
 def get_latest_example_values(metric_name, index):
 
-    return {
+    return compact_example({
         'input': st.session_state.get(f"input_{metric_name}_{index}", ""),
         'response': st.session_state.get(f"response_{metric_name}_{index}", ""),
         'score': st.session_state.get(f"score_{metric_name}_{index}", ""),
         'critique': st.session_state.get(f"critique_{metric_name}_{index}", ""),
         'reference': st.session_state.get(f"reference_{metric_name}_{index}", ""),
         'context': st.session_state.get(f"context_{metric_name}_{index}", "")
-    }
+    })
+
+def sync_custom_metrics(revision):
+    # Pick up metrics deployed, changed or deleted by any session; unsaved local edits to the
+    # current version of a metric are kept. Nothing is copied unless the store has changed.
+    if st.session_state.get("synced_revision") == revision:
+        return
+    st.session_state.synced_revision = revision
+    # Already refreshed by the revision check
+    stored_metrics = get_store().all(refresh=False)
+    local_metrics = st.session_state.custom_metrics
+    for name, metric in stored_metrics.items():
+        local = local_metrics.get(name)
+        if local is None or (local.get("version"), list(local.get("tags", []))) != (metric["version"], metric["tags"]):
+            # Held compactly: long texts live once in the shared text store, not in every session
+            local_metrics[name] = compact_metric(metric)
+            st.session_state.prompt_inputs[name] = prompt_inputs(
+                metric["input_variables"], metric["criteria"], metric["scoring_rubric"],
+                format_examples(metric["examples"], metric["input_variables"])
+            )
+    for name in [name for name in local_metrics if name not in stored_metrics]:
+        del local_metrics[name]
+
+def deploy_metric(metric_name, metric, tags, generated_from=None):
+    # Only a changed definition adds a version to the store
+    get_store().save(metric_name, to_plain(metric), tags)
+    st.session_state.custom_metrics[metric_name] = compact_metric(get_store().get(metric_name))
+    # Keeps the inputs the prompt was generated from (a new metric's come from its temp state),
+    # so the next regenerate only rewrites what changed since
+    if generated_from is not None:
+        st.session_state.prompt_inputs[metric_name] = generated_from
+    elif metric_name not in st.session_state.prompt_inputs:
+        st.session_state.prompt_inputs[metric_name] = prompt_inputs(
+            metric["input_variables"], metric["criteria"], metric["scoring_rubric"],
+            format_examples(metric["examples"], metric["input_variables"])
+        )
+
+def start_rerun_trace():
+    # A rerun cut short (st.rerun(), a widget interaction) never reaches the end of the script;
+    # its trace is closed when the next one starts
+    if 'profile_traces' not in st.session_state:
+        st.session_state.profile_traces = deque(maxlen=PROFILE_HISTORY)
+    traces = st.session_state.profile_traces
+    if traces and traces[-1].end is None:
+        traces[-1].finish(interrupted=True)
+    if not st.session_state.get("profile_reruns", PROFILE_BY_DEFAULT):
+        end_trace()
+        return None
+    trace = start_trace("rerun")
+    traces.append(trace)
+    return trace
+
+def section(name):
+    if rerun_trace is not None:
+        rerun_trace.section(name)
+
+def show_profile_panel():
+    with st.sidebar.expander("Profiling"):
+        st.checkbox("Profile reruns", value=PROFILE_BY_DEFAULT, key="profile_reruns")
+        traces = [trace for trace in st.session_state.profile_traces if trace.end is not None]
+        if not traces:
+            st.caption("No profiled reruns yet.")
+            return
+        last = traces[-1]
+        st.caption(f"Last rerun: {last.duration * 1000:.0f}ms{' (interrupted)' if last.interrupted else ''}, "
+                   f"average {sum(trace.duration for trace in traces) / len(traces) * 1000:.0f}ms over {len(traces)}")
+        st.dataframe([{"section": span.name, "ms": round(span.duration * 1000, 1)} for span in last.sections()], hide_index=True)
+        calls = [span for trace in traces for span in trace.completions()]
+        if calls:
+            st.dataframe([{
+                "ms": round(span.duration * 1000),
+                "cache": span.args.get("cache"),
+                "prompt tokens": span.args.get("prompt_tokens"),
+                "completion tokens": span.args.get("completion_tokens"),
+                "stream": bool(span.args.get("stream")),
+            } for span in calls[-PROFILE_HISTORY:]], hide_index=True)
+        st.download_button("Export trace", data=chrome_trace(list(st.session_state.profile_traces)),
+                           file_name="reruns.trace.json", mime="application/json")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_files(store_revision, names):
+    # Deployed versions only, rebuilt when the store changes rather than on every rerun
+    metrics = get_store().all()
+    selected = {name: metrics[name] for name in names if name in metrics}
+    # Deployed metrics in the format evaluation.py --metrics expects
+    jsonl = "".join(json.dumps(metric, ensure_ascii=False) + "\n" for metric in selected.values())
+    # Compiled bundle for evaluator services (see metric_bundle.py)
+    bundle = io.BytesIO()
+    write_bundle(selected, bundle)
+    return jsonl, bundle.getvalue()
+
+@st.fragment
+def metrics_library(store_revision):
+    # Filtering and downloading rerun only this fragment, with the revision the session last synced
+    st.title("Eval Metrics Library")
+
+    # Display Base Metrics
+    st.subheader("Base Metrics:")
+    st.text("\n".join(reserved_metrics))
+
+    # Display Custom Metrics
+    st.subheader("Custom Metrics:")
+    metric_tags = get_store().tags(refresh=False)
+    tag_filter = st.selectbox("Filter by tag", ["All"] + metric_tags) if metric_tags else "All"
+    custom_metrics = [name for name, metric in st.session_state.custom_metrics.items() if tag_filter == "All" or tag_filter in metric.get("tags", [])]
+    if custom_metrics:
+        st.text("\n".join(custom_metrics))
+        metrics_export, bundle = export_files(store_revision, tuple(custom_metrics))
+        st.download_button("Export metrics (JSONL)", data=metrics_export, file_name="metrics.jsonl", mime="application/jsonl", on_click="ignore")
+        st.download_button("Export bundle", data=bundle, file_name="metrics.bundle", mime="application/octet-stream", on_click="ignore")
+    else:
+        st.text("No custom metrics created yet.")
 
-def is_valid_variable_name(name):
-    return re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name) is not None
+@st.fragment
+def example_editor(metric_name, examples, input_variables, criteria, scoring_rubric):
+    # Switching or editing an example reruns only this fragment; the edits land in the examples
+    # list in session state, which the rest of the page reads on its next full rerun
+    example_options = [f"Example {i+1}" for i in range(len(examples))]
+    index = min(st.session_state.get("selected_example", 0), len(examples) - 1)
+    selected_example = st.selectbox("Select example", options=example_options, index=index)
 
-def clear_temp_state():
-    del st.session_state.temp_prompt
-    del st.session_state.editing_metric
+    # Extract the number from the selected option
+    selected_index = int(selected_example.split()[-1]) - 1
+    st.session_state.selected_example = selected_index
 
-def initialize_new_metric(metric_name):
-    return {
-        "criteria": "",
-        "scoring_rubric": "Likert: 1 - 5",  # Default to the first option
-        "input_variables": ["input", "response"],
-        "prompt": "",
-        "examples": [{}]
-    }
-
-
-reserved_metric_info = {
-    "hallucination": {
-        "criteria": "Assesses presence of incorrect of unrelated content in the AI’s response.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response", "reference"]
-    },
-    "context_relevance": {
-        "criteria": "Measures how on-point the retrieved context is.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response", "context"]
-    },
-
-    "groundedness": {
-        "criteria": "Determines if the response is factually based on the provided context.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response", "context"]
-    },
-
-    "precision": {
-        "criteria": "Assesses the relevance of all the information in the response.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response", "reference"]
-    },
+    with st.expander(selected_example, expanded=True):
+        example = examples[selected_index] = compact_example(examples[selected_index])
+        
+        example['input'] = st.text_area("Input", value=example.get('input', ''), key=f"input_{metric_name}_{selected_index}", placeholder="Enter example input here...")
+        example['response'] = st.text_area("Response", value=example.get('response', ''), key=f"response_{metric_name}_{selected_index}", placeholder="Enter example response here...")
+
+        # Conditional inputs based on selected input variables
+        if "reference" in input_variables:
+            example['reference'] = st.text_area("Reference", value=example.get('reference', ''), key=f"reference_{metric_name}_{selected_index}", placeholder="Enter example reference here...")
+        if "context" in input_variables:
+            example['context'] = st.text_area("Context", value=example.get('context', ''), key=f"context_{metric_name}_{selected_index}", placeholder="Enter example context here...")
+
+        example['score'] = st.text_input("Score", value=example.get('score', ''), key=f"score_{metric_name}_{selected_index}", placeholder="Enter example score here...")
+        example['critique'] = st.text_area("Critique", value=example.get('critique', ''), key=f"critique_{metric_name}_{selected_index}", placeholder="Enter example critique here...")
+
+        examples[selected_index] = example
+
+    show_prompt_tokens(input_variables, criteria, scoring_rubric, format_examples(examples, input_variables))
+
+@st.fragment
+def custom_prompt_editor(metric_name, criteria, scoring_rubric, input_variables):
+    # Editing the prompt or tags reruns only this fragment; examples are read from session state
+    # since the example editor may have changed them since the last full rerun
+    metric_data = st.session_state.custom_metrics[metric_name]
+    st.subheader("Edit the Generated Prompt")
+    edited_prompt = st.text_area("Edit Prompt", value=metric_data["prompt"], height=300)
+    tags = st.text_input("Tags", value=", ".join(metric_data.get("tags", [])), placeholder="Comma-separated, e.g. rag, safety")
+    if metric_data.get("version"):
+        st.caption(f"Version {metric_data['version']}")
     
-    "logical_coherence": {
-        "criteria": "Measures the logical flow, consistency, and rationality of the response.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response"]
-    },
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("Deploy Metric"):
+            deploy_metric(metric_name, {
+                "criteria": criteria,
+                "scoring_rubric": scoring_rubric,
+                "input_variables": input_variables,
+                "prompt": edited_prompt,
+                "examples": metric_data['examples']  # Save all examples
+            }, parse_tags(tags))
+            st.success("Changes saved successfully!")
+    with col2:
+        if st.button("Delete Metric"):
+            get_store().delete(metric_name)
+            del st.session_state.custom_metrics[metric_name]
+            st.success(f"Metric '{metric_name}' deleted successfully!")
+            st.rerun()
+    with col3:
+        if st.button("Regenerate Prompt", disabled=bool(session_jobs(metric_name, "prompt"))):
+            examples = format_examples(metric_data['examples'], input_variables)
+            start_prompt_job(metric_name, "custom", input_variables, criteria, scoring_rubric, examples, edited_prompt)
+
+@st.fragment
+def new_prompt_editor(metric_name, criteria, scoring_rubric, input_variables):
+    # Editing the generated prompt or tags reruns only this fragment
+    temp_metric_data = st.session_state.temp_metric_data
+    st.subheader("Edit the Generated Prompt")
+    edited_prompt = st.text_area("Edit Prompt", value=st.session_state.temp_prompt, height=300)
+    temp_metric_data['prompt'] = edited_prompt
+    tags = st.text_input("Tags", placeholder="Comma-separated, e.g. rag, safety")
     
-    "recall": {
-        "criteria": "Measures how complete the response captures the key facts and details.",
-        "scoring_rubric": "Likert: 1 - 5",
-        "input_variables": ["input", "response", "reference"]
-    }
-    # Add information for other reserved metrics here
-}
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("Deploy Metric"):
+            if not metric_name or not is_valid_variable_name(metric_name):
+                st.error("Please enter a valid metric name. It should start with a letter or underscore and contain only letters, numbers, or underscores.")
+            elif metric_name.lower() in RESERVED_METRIC_NAMES:
+                st.error("Please choose a metric name that is not one of the Atla base metrics.")
+            elif not criteria or not scoring_rubric:
+                st.error("Please fill in all required fields.")
+            else:
+                deploy_metric(metric_name, {
+                    "criteria": criteria,
+                    "scoring_rubric": scoring_rubric,
+                    "input_variables": input_variables,
+                    "prompt": edited_prompt,
+                    "examples": temp_metric_data['examples']
+                }, parse_tags(tags), st.session_state.get("temp_prompt_inputs"))
+                st.success(f"Metric '{metric_name}' deployed successfully!")
+                clear_temp_state
+                st.rerun()
+    with col2:
+        if st.button("Clear"):
+            del st.session_state.temp_prompt
+            clear_temp_state
+            st.rerun()
+    with col3:
+        if st.button("Regenerate Prompt", disabled=bool(session_jobs(metric_name, "prompt"))):
+            examples = format_examples(temp_metric_data['examples'], input_variables)
+            start_prompt_job(metric_name, "temp", input_variables, criteria, scoring_rubric, examples, edited_prompt)
 
-reserved_metrics = list(reserved_metric_info.keys())
+def clear_temp_state():
+    del st.session_state.temp_prompt
+    del st.session_state.editing_metric
 
 
 ###
+rerun_trace = start_rerun_trace()
+section("state")
+
 st.title("Create Evaluation Metrics")
 
 if 'custom_metrics' not in st.session_state:
     st.session_state.custom_metrics = {}
+# Inputs each metric's prompt was generated from, to regenerate only the sections they changed
+if 'prompt_inputs' not in st.session_state:
+    st.session_state.prompt_inputs = {}
+# The store's revision is read once per rerun and passed to everything that needs it
+store_revision = get_store().revision()
+sync_custom_metrics(store_revision)
 
 if 'show_edit_prompt' not in st.session_state:
     st.session_state.show_edit_prompt = False
 
-# Add Eval Metrics Library to the sidebar
-st.sidebar.title("Eval Metrics Library")
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {}
 
-# Display Base Metrics
-st.sidebar.subheader("Base Metrics:")
-st.sidebar.text("\n".join(reserved_metrics))
+# Jobs still running in this rerun, followed live at the end of the script
+running_jobs = []
 
-# Display Custom Metrics
-st.sidebar.subheader("Custom Metrics:")
-custom_metrics = list(st.session_state.custom_metrics.keys())
-if custom_metrics:
-    st.sidebar.text("\n".join(custom_metrics))
-else:
-    st.sidebar.text("No custom metrics created yet.")
+section("sidebar")
+
+# Add Eval Metrics Library to the sidebar
+with st.sidebar:
+    metrics_library(store_revision)
 
 # Add a separator
 st.sidebar.markdown("---")
 
+# Completion cache controls
+bypass_cache = st.sidebar.checkbox("Bypass cache", value=False, help="Always request a fresh sample from the model instead of reusing a cached result.")
+cache_stats = get_cache().stats()
+st.sidebar.caption(f"Cache: {cache_stats['entries']} entries, {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+limiter_stats = get_limiter().stats()
+st.sidebar.caption(f"API queue: {limiter_stats['queue_depth']} waiting, avg wait {limiter_stats['avg_wait']:.2f}s, {limiter_stats['retries']} retries")
+st.sidebar.caption(f"Shared in-flight calls: {get_single_flight().stats()['coalesced']} duplicate requests coalesced")
+job_stats = get_executor().stats()
+st.sidebar.caption(f"Background jobs: {job_stats['pending'] + job_stats['running']} running, {job_stats['failed'] + job_stats['timed_out']} failed or timed out")
+# Walks the whole session state, so only measured when asked
+if st.sidebar.button("Measure session memory"):
+    session_bytes, stored_chars = session_memory(st.session_state)
+    text_stats = get_text_store().stats()
+    st.sidebar.caption(f"Session data: {session_bytes / 1024:.0f} KB in memory, {stored_chars / 1024:.0f}K chars in the shared text store "
+                       f"({text_stats['texts']} texts, {text_stats['resident_bytes'] / 1024:.0f} KB resident)")
+show_profile_panel()
+
+section("metric form")
+
 #Metric name input
 metric_name = st.text_input("Metric Name", key="metric_name", placeholder="Enter a name for this metric...")                
 
@@ -315,85 +466,20 @@ if metric_name in st.session_state.custom_metrics:
         default=metric_data["input_variables"]
     )
     
+    section("examples")
     st.subheader("Few-shot examples")
 
     # Button to add a new example (up to 3)
     if len(metric_data['examples']) < 3 and st.button("Add another example"):
-        metric_data['examples'].append({})
-        st.experimental_rerun()  # Rerun to update the selectbox options
+        metric_data['examples'].append(ExampleRecord())
+        st.rerun()  # Rerun to update the selectbox options
 
     
-    # Dropdown to select example number
-    example_options = [f"Example {i}" for i in range(1, len(metric_data['examples']) + 1)]
-    example_number = st.selectbox("Select example", options=example_options)
-
-    # Extract the number from the selected option
-    selected_index = int(example_number.split()[-1]) - 1
-
-    # Display fields for the selected example
-    with st.expander(example_number, expanded=True):
-        example = metric_data['examples'][selected_index]
-        
-        example['input'] = st.text_area("Input", value=example.get('input', ''), key=f"input_{metric_name}_{selected_index}", placeholder="Enter example input here...")
-        example['response'] = st.text_area("Response", value=example.get('response', ''), key=f"response_{metric_name}_{selected_index}", placeholder="Enter example response here...")
-
-        # Conditional inputs based on selected input variables
-        if "reference" in input_variables:
-            example['reference'] = st.text_area("Reference", value=example.get('reference', ''), key=f"reference_{metric_name}_{selected_index}", placeholder="Enter example reference here...")
-        if "context" in input_variables:
-            example['context'] = st.text_area("Context", value=example.get('context', ''), key=f"context_{metric_name}_{selected_index}", placeholder="Enter example context here...")
-
-        example['score'] = st.text_input("Score", value=example.get('score', ''), key=f"score_{metric_name}_{selected_index}", placeholder="Enter example score here...")
-        example['critique'] = st.text_area("Critique", value=example.get('critique', ''), key=f"critique_{metric_name}_{selected_index}", placeholder="Enter example critique here...")
-
-        # Update the metric data
-        metric_data['examples'][selected_index] = example
-
-    # Combine all examples to form the 'Examples' variable for the Prompt generation
-    examples = ""
-    for i, example in enumerate(metric_data['examples'], 1):
-        examples += f"Example {i}:\n"
-        examples += f"Input: {example.get('input', '')}\n\n"
-        examples += f"Response: {example.get('response', '')}\n\n"
-        if "reference" in input_variables:
-            examples += f"Reference: {example.get('reference', '')}\n\n"
-        if "context" in input_variables:
-            examples += f"Context: {example.get('context', '')}\n\n"
-        examples += f"Score: {example.get('score', '')}\n\n"
-        examples += f"Critique: {example.get('critique', '')}\n\n"
-    
-    st.subheader("Edit the Generated Prompt")
-    edited_prompt = st.text_area("Edit Prompt", value=metric_data["prompt"], height=300)
+    example_editor(metric_name, metric_data['examples'], input_variables, criteria, scoring_rubric)
     
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        if st.button("Deploy Metric"):
-            st.session_state.custom_metrics[metric_name] = {
-                "criteria": criteria,
-                "scoring_rubric": scoring_rubric,
-                "input_variables": input_variables,
-                "prompt": edited_prompt,
-                "examples": metric_data['examples']  # Save all examples
-            }
-            st.success("Changes saved successfully!")
-    with col2:
-        if st.button("Delete Metric"):
-            del st.session_state.custom_metrics[metric_name]
-            st.success(f"Metric '{metric_name}' deleted successfully!")
-            st.experimental_rerun()
-    with col3:
-        if st.button("Regenerate Prompt"):
-            try:
-                with st.spinner("Regenerating prompt..."):
-                    generated_prompt = generate_prompt(input_variables, criteria, scoring_rubric, examples)
-                if generated_prompt:
-                    st.session_state.custom_metrics[metric_name]["prompt"] = generated_prompt
-                    st.success("Prompt regenerated successfully!")
-                    st.experimental_rerun()
-                else:
-                    st.error("Failed to regenerate prompt.")
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+    section("prompt")
+    apply_prompt_jobs(metric_name)
+    custom_prompt_editor(metric_name, criteria, scoring_rubric, input_variables)
 
 elif metric_name in reserved_metrics:
     # Display information for reserved metrics
@@ -414,6 +500,7 @@ elif metric_name in reserved_metrics:
         disabled=True
     )
     
+    section("examples")
     st.subheader("Few-shot examples")
 
     # Display a single, non-interactive example
@@ -466,6 +553,7 @@ else:
     st.session_state.show_edit_prompt = False
 
     # Initialize examples in session state if not present
+    section("examples")
     st.subheader("Few-shot examples")
 
     # Check if the metric name has changed
@@ -485,135 +573,69 @@ else:
     with col1:
         # Button to add a new example (up to 3)
         if len(temp_metric_data['examples']) < 3 and st.button("Add another example"):
-            temp_metric_data['examples'].append({})
+            temp_metric_data['examples'].append(ExampleRecord())
             st.session_state.selected_example = len(temp_metric_data['examples']) - 1
             st.session_state.temp_metric_data = temp_metric_data
-            st.experimental_rerun()
+            st.rerun()
 
     with col2:
-        # Button to generate a new example (up to 3)
-        if len(temp_metric_data['examples']) < 3 and st.button("Generate example"):
-            try:
-                with st.spinner("Generating example..."):
-                    existing_example = temp_metric_data['examples'][0]
-                    generated_example_json = generate_example(criteria, scoring_rubric, input_variables, str(existing_example))
-                    if generated_example_json:
-                        generated_example = json.loads(generated_example_json)
-                        temp_metric_data['examples'].append(generated_example)
-                        st.session_state.selected_example = len(temp_metric_data['examples']) - 1
-                        st.session_state.temp_metric_data = temp_metric_data
-                        st.success("New example generated successfully!")
-                        st.experimental_rerun()
+        # Generate the remaining example slots (up to 3) concurrently in the background and insert them in one rerun
+        remaining_slots = 3 - len(temp_metric_data['examples'])
+        examples_job_running = bool(session_jobs(metric_name, "examples"))
+        if remaining_slots > 0:
+            n_examples = st.number_input("Examples to generate", min_value=1, max_value=remaining_slots, value=remaining_slots)
+            if st.button("Generate examples", disabled=examples_job_running):
+                job_id = get_executor().submit(
+                    generate_examples, criteria, scoring_rubric, input_variables, to_plain(temp_metric_data['examples']), int(n_examples),
+                    bypass_cache=bypass_cache, kind="generate_examples", deadline=EXAMPLES_JOB_DEADLINE
+                )
+                st.session_state.temp_metric_data = temp_metric_data
+                start_job(job_id, "examples", metric_name)
+
+        for job_id, meta in session_jobs(metric_name, "examples"):
+            job = finished_job(job_id)
+            if job is None:
+                if job_id in st.session_state.jobs:
+                    show_running_job(job_id, "Generating examples...")
+            elif job.status == DONE:
+                generated_examples, failed = job.result
+                if generated_examples:
+                    temp_metric_data['examples'].extend(compact_example(example) for example in generated_examples[:3 - len(temp_metric_data['examples'])])
+                    st.session_state.selected_example = len(temp_metric_data['examples']) - 1
+                    st.session_state.temp_metric_data = temp_metric_data
+                    if failed:
+                        st.toast(f"{len(generated_examples)} of {len(generated_examples) + failed} example(s) generated.")
                     else:
-                        st.error("Failed to generate example.")
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
-
-    # Create example options based on the number of examples in session state
-    example_options = [f"Example {i+1}" for i in range(len(temp_metric_data['examples']))]
-    selected_example = st.selectbox("Select example", options=example_options, index=st.session_state.selected_example)
-
-    # Extract the number from the selected option
-    selected_index = int(selected_example.split()[-1]) - 1
-    st.session_state.selected_example = selected_index
-    
-
-    with st.expander(selected_example, expanded=True):
-        example = temp_metric_data['examples'][selected_index]
-        
-        example['input'] = st.text_area("Input", value=example.get('input', ''), key=f"input_{metric_name}_{selected_index}", placeholder="Enter example input here...")
-        example['response'] = st.text_area("Response", value=example.get('response', ''), key=f"response_{metric_name}_{selected_index}", placeholder="Enter example response here...")
-
-        # Conditional inputs based on selected input variables
-        if "reference" in input_variables:
-            example['reference'] = st.text_area("Reference", value=example.get('reference', ''), key=f"reference_{metric_name}_{selected_index}", placeholder="Enter example reference here...")
-        if "context" in input_variables:
-            example['context'] = st.text_area("Context", value=example.get('context', ''), key=f"context_{metric_name}_{selected_index}", placeholder="Enter example context here...")
-
-        example['score'] = st.text_input("Score", value=example.get('score', ''), key=f"score_{metric_name}_{selected_index}", placeholder="Enter example score here...")
-        example['critique'] = st.text_area("Critique", value=example.get('critique', ''), key=f"critique_{metric_name}_{selected_index}", placeholder="Enter example critique here...")
-
-        # Update the temp metric data
-        temp_metric_data['examples'][selected_index] = example
+                        st.success(f"{len(generated_examples)} new example(s) generated successfully!")
+                    st.rerun()
+                else:
+                    st.error(f"Failed to generate example (0 of {failed} generated; responses were invalid, duplicates or errors).")
 
     # After the loop, update the session state
     st.session_state.temp_metric_data = temp_metric_data
+    example_editor(metric_name, temp_metric_data['examples'], input_variables, criteria, scoring_rubric)
     
     # Combine all examples to form the 'Examples' variable
-    examples = ""
-    for i, example in enumerate(temp_metric_data['examples'], 1):
-        examples += f"Example {i}:\n"
-        examples += f"Input: {example.get('input', '')}\n\n"
-        examples += f"Response: {example.get('response', '')}\n\n"
-        if "reference" in input_variables:
-            examples += f"Reference: {example.get('reference', '')}\n\n"
-        if "context" in input_variables:
-            examples += f"Context: {example.get('context', '')}\n\n"
-        examples += f"Score: {example.get('score', '')}\n\n"
-        examples += f"Critique: {example.get('critique', '')}\n\n"
+    examples = format_examples(temp_metric_data['examples'], input_variables)
 
-    if st.button("Generate Prompt", disabled=not compulsory_selected):
+    if st.button("Generate Prompt", disabled=not compulsory_selected or bool(session_jobs(metric_name, "prompt"))):
         if not metric_name or not is_valid_variable_name(metric_name):
             st.error("Please enter a valid metric name. It should start with a letter or underscore and contain only letters, numbers, or underscores.")
-        elif metric_name.lower() in [m.lower() for m in reserved_metrics]:
+        elif metric_name.lower() in RESERVED_METRIC_NAMES:
             st.error("Please choose a metric name that is not one of the Atla base metrics.")
         elif not criteria or not scoring_rubric:
             st.error("Please fill in all required fields.")
         else:
-            try:
-                with st.spinner("Generating prompt..."):
-                    generated_prompt = generate_prompt(input_variables, criteria, scoring_rubric, examples)
-                if generated_prompt:
-                    st.success("Prompt generated successfully!")
-                    st.session_state.temp_prompt = generated_prompt
-                    st.session_state.editing_metric = metric_name
-                else:
-                    st.error("Failed to generate prompt.")
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            start_prompt_job(metric_name, "temp", input_variables, criteria, scoring_rubric, examples)
+
+    section("prompt")
+    apply_prompt_jobs(metric_name)
 
     # Edit and Save section for newly generated prompt
     if 'temp_prompt' in st.session_state and st.session_state.editing_metric == metric_name:
-        st.subheader("Edit the Generated Prompt")
-        edited_prompt = st.text_area("Edit Prompt", value=st.session_state.temp_prompt, height=300)
-        temp_metric_data['prompt'] = edited_prompt
-        
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            if st.button("Deploy Metric"):
-                if not metric_name or not is_valid_variable_name(metric_name):
-                    st.error("Please enter a valid metric name. It should start with a letter or underscore and contain only letters, numbers, or underscores.")
-                elif metric_name.lower() in [m.lower() for m in reserved_metrics]:
-                    st.error("Please choose a metric name that is not one of the Atla base metrics.")
-                elif not criteria or not scoring_rubric:
-                    st.error("Please fill in all required fields.")
-                else:
-                    st.session_state.custom_metrics[metric_name] = {
-                        "criteria": criteria,
-                        "scoring_rubric": scoring_rubric,
-                        "input_variables": input_variables,
-                        "prompt": edited_prompt,
-                        "examples": temp_metric_data['examples']
-                    }                            
-                    st.success(f"Metric '{metric_name}' deployed successfully!")
-                    clear_temp_state
-                    st.experimental_rerun()
-        with col2:
-            if st.button("Clear"):
-                del st.session_state.temp_prompt
-                clear_temp_state
-                st.experimental_rerun()
-        with col3:
-            if st.button("Regenerate Prompt"):
-                try:
-                    with st.spinner("Regenerating prompt..."):
-                        generated_prompt = generate_prompt(input_variables, criteria, scoring_rubric, examples)
-                    if generated_prompt:
-                        temp_metric_data['prompt'] = generated_prompt
-                        st.session_state.temp_prompt = generated_prompt
-                        st.success("Prompt regenerated successfully!")
-                        st.experimental_rerun()
-                    else:
-                        st.error("Failed to regenerate prompt.")
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
\ No newline at end of file
+        new_prompt_editor(metric_name, criteria, scoring_rubric, input_variables)
+
+section("follow jobs")
+follow_running_jobs()
+if rerun_trace is not None:
+    rerun_trace.finish()
@@ -0,0 +1,201 @@
+"""Prometheus metrics for LLM usage: requests, errors, latency, tokens and estimated cost.
+
+Operations (generate_prompt, generate_example, evaluate, ...) are counted and timed as a
+whole; every completion made inside one is attributed to it with its cache status, token
+usage and estimated cost. Set METRICS_PORT to serve them in the Prometheus text format:
+
+    $ METRICS_PORT=9464 streamlit run streamlit_app.py
+    $ curl http://127.0.0.1:9464/metrics
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# USD per 1K (prompt, completion) tokens; models are matched by longest prefix
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+METRICS = {
+    "llm_operation_requests_total": ("counter", "Operations started."),
+    "llm_operation_errors_total": ("counter", "Operations that raised, by exception type."),
+    "llm_operation_duration_seconds": ("histogram", "Operation latency, including queueing and retries."),
+    "llm_completions_total": ("counter", "Completions requested, by cache status."),
+    "llm_tokens_total": ("counter", "Tokens used by API calls."),
+    "llm_cost_usd_total": ("counter", "Estimated API cost in US dollars."),
+    "llm_generated_duplicates_total": ("counter", "Generated examples rejected as near-duplicates."),
+    "llm_escalations_total": ("counter", "Cascade judgements passed on to the next stage, by stage and reason."),
+}
+
+_current_operation = contextvars.ContextVar("current_operation", default=None)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            prompt_price, completion_price = MODEL_PRICES[name]
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    return 0.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # Per-bucket counts, then sum and count; made cumulative when rendered
+            histogram = self._histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """All series in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series, labels), value in counters:
+                if series == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (series, labels), values in histograms:
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+def current_operation():
+    return _current_operation.get()
+
+
+@contextlib.contextmanager
+def operation(name):
+    """Count and time the block as one operation; completions inside it are attributed to it."""
+    token = _current_operation.set(name)
+    started = time.perf_counter()
+    _registry.inc("llm_operation_requests_total", operation=name)
+    try:
+        yield
+    except Exception as e:
+        _registry.inc("llm_operation_errors_total", operation=name, error=type(e).__name__)
+        raise
+    finally:
+        _registry.observe("llm_operation_duration_seconds", time.perf_counter() - started, operation=name)
+        _current_operation.reset(token)
+
+
+def track_stream(name, chunks):
+    # operation() for a generator: timed from the first to the last chunk pulled
+    started = time.perf_counter()
+    _registry.inc("llm_operation_requests_total", operation=name)
+    try:
+        yield from chunks
+    except Exception as e:
+        _registry.inc("llm_operation_errors_total", operation=name, error=type(e).__name__)
+        raise
+    finally:
+        _registry.observe("llm_operation_duration_seconds", time.perf_counter() - started, operation=name)
+
+
+def record_completion(model, info):
+    # info is the completion's profiling args: cache status and, when the API was called, token usage
+    name = info.get("operation") or current_operation() or "other"
+    _registry.inc("llm_completions_total", operation=name, model=model, cache=info.get("cache", "error"))
+    prompt_tokens = info.get("prompt_tokens") or 0
+    completion_tokens = info.get("completion_tokens") or 0
+    if prompt_tokens or completion_tokens:
+        _registry.inc("llm_tokens_total", prompt_tokens, operation=name, model=model, type="prompt")
+        _registry.inc("llm_tokens_total", completion_tokens, operation=name, model=model, type="completion")
+        _registry.inc("llm_cost_usd_total", estimate_cost(model, prompt_tokens, completion_tokens), operation=name, model=model)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = _registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics on a background thread; later calls return the running server."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def start_metrics_server_from_env():
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        return start_metrics_server(int(port), os.environ.get("METRICS_HOST", "127.0.0.1"))
+    return None